@@ -0,0 +1,69 @@
+"""
+Benchmark the ANN index against the exact recommender scan.
+
+Builds a synthetic catalog of destinations (or loads the real one with --db),
+then reports recall@k and average query latency for several nprobe values.
+
+Usage: python ann_benchmark.py --cities 50000 --queries 200 --k 15
+"""
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+
+import recommender
+
+
+def synthetic_matrix(n_cities, n_categories, seed):
+    """Destinations drawn around a few archetypes, with values in [1, 10]"""
+    rng = np.random.default_rng(seed)
+    archetypes = rng.uniform(1, 10, size=(32, n_categories))
+    values = archetypes[rng.integers(0, len(archetypes), n_cities)] + rng.normal(0, 1.5, size=(n_cities, n_categories))
+    values = np.clip(np.rint(values), 1, 10)
+    categories = [f"category_{i}" for i in range(n_categories)]
+    cities = [f"city_{i:06d}" for i in range(n_cities)]
+    return recommender.CityMatrix(categories, cities, values)
+
+
+def run(matrix, n_queries, k, probes, seed):
+    rng = np.random.default_rng(seed + 1)
+    queries = rng.uniform(1, 10, size=(n_queries, len(matrix.categories))).astype(np.float32)
+
+    start = time.perf_counter()
+    matrix.index
+    print(f"Catalog: {len(matrix.cities)} cities x {len(matrix.categories)} categories, "
+          f"{matrix.index.n_lists} lists, index built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    exact = [{city for city, _ in matrix.rank(q, limit=k, nprobe=0)} for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / n_queries
+    print(f"{'exact':>10}  recall@{k}=1.000  {exact_ms:.3f} ms/query")
+
+    for nprobe in probes:
+        start = time.perf_counter()
+        approx = [{city for city, _ in matrix.rank(q, limit=k, nprobe=nprobe)} for q in queries]
+        approx_ms = (time.perf_counter() - start) * 1000 / n_queries
+        recall = np.mean([len(a & e) / len(e) for a, e in zip(approx, exact)])
+        print(f"{'nprobe=' + str(nprobe):>10}  recall@{k}={recall:.3f}  {approx_ms:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Benchmark the catalog in this SQLite database instead of synthetic data")
+    parser.add_argument("--cities", type=int, default=50000)
+    parser.add_argument("--categories", type=int, default=15)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.db:
+        conn = sqlite3.connect(args.db)
+        matrix = recommender.CityMatrix.load(conn)
+        conn.close()
+    else:
+        matrix = synthetic_matrix(args.cities, args.categories, args.seed)
+
+    run(matrix, args.queries, args.k, args.probes, args.seed)
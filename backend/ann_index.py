@@ -0,0 +1,66 @@
+"""
+Approximate nearest-neighbour indexes over normalized city vectors.
+
+An index only narrows down which rows of the city matrix are worth scoring;
+the exact cosine scores of those candidates are still computed by the
+recommender, so an index trades recall for latency but never changes a score.
+"""
+import numpy as np
+
+
+class IVFIndex:
+    """Inverted-file index: cities partitioned by spherical k-means.
+
+    A query scores the `nprobe` closest centroids and returns the members of
+    those partitions as candidates. More probes means higher recall and more
+    work; probing every list degenerates to an exact scan.
+    """
+
+    def __init__(self, vectors, n_lists=None, n_iter=15, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        if n_lists is None:
+            n_lists = int(np.sqrt(n))
+        self.n_lists = max(1, min(n_lists, n))
+
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n, self.n_lists, replace=False)] if n else np.zeros((1, vectors.shape[1]), dtype=np.float32)
+        assign = np.zeros(n, dtype=np.intp)
+        for _ in range(n_iter):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty partitions keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        self.centroids = centroids
+        self.order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=self.n_lists)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def candidates(self, query, nprobe):
+        """Row indices of the cities in the `nprobe` partitions closest to query"""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        closeness = self.centroids @ np.asarray(query, dtype=np.float32)
+        if nprobe < self.n_lists:
+            lists = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+        else:
+            lists = np.arange(self.n_lists)
+        members = [self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists]
+        return np.sort(np.concatenate(members))
+
+
+# Available index implementations, selectable by name
+INDEXES = {
+    "ivf": IVFIndex,
+}
+
+
+def build_index(vectors, kind="ivf", **options):
+    """Build an index of the given kind over L2-normalized vectors"""
+    try:
+        index_class = INDEXES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown ANN index type: {kind}")
+    return index_class(vectors, **options)
@@ -1,21 +1,76 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Body, Query, Response
+from fastapi import FastAPI, HTTPException, Depends, status, Body, Query, Header, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional, Dict, Any
-from passlib.context import CryptContext
+from typing import List, Literal, Optional, Dict, Any
+from contextlib import asynccontextmanager
 from jose import JWTError, jwt
 import sqlite3
 import os
+import hashlib
 import numpy as np
-from scipy.spatial.distance import cosine
 from datetime import datetime, timedelta
 import random
 from sqlalchemy.orm import Session
-import crud # Assuming you have crud.py
+import collaborative
+import db_async
+import db_pool
+import db_writer
+import flight_index
+import group_centroids
+import image_cache
+import image_store
+import migrations
+import passwords
+import preference_cache
+import recommendation_refresher
+import recommender
+import sql_stats
+import user_cache
+import vote_queue
+
+DB_PATH = "data/reunion.db"
+
+# Reader connections plus one writer, configured once and reused across requests
+pool = db_pool.ConnectionPool(DB_PATH, factory=sql_stats.connection_factory())
+# Reads run on pooled connections in a thread pool, off the event loop
+db = db_async.AsyncDatabase(pool)
+# All writes go through this thread, which owns the pool's writer connection
+writer = db_writer.DatabaseWriter(pool)
+
+def connect_db():
+    """Open a dedicated configured connection (background workers)"""
+    return pool.connect()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bring the schema up to date (see migrations.py) and fill derived data
+    with pool.writer() as conn:
+        migrations.migrate(conn)
+        group_centroids.backfill(conn)
+        conn.commit()
+    
+    # Background workers: the single writer, the consumer applying queued
+    # votes and the refreshers keeping the materialized recommendations fresh
+    writer.start()
+    vote_consumer.start()
+    refresher.start()
+    if flight_index.FLIGHT_INDEX:
+        # Loaded up front so the first search does not pay for it
+        await db.run(flight_index.get_flight_index)
+    try:
+        yield
+    finally:
+        vote_consumer.stop()  # Its final drain still goes through the writer
+        refresher.stop()
+        db.close()
+        writer.stop()
+        pool.close()
+        passwords.shutdown()
 
 # Initialize FastAPI app
-app = FastAPI(title="The Perfect Reunion API")
+app = FastAPI(title="The Perfect Reunion API", lifespan=lifespan)
 
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
@@ -24,31 +79,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
-# Database connection
-def get_db():
-    db_path = "data/reunion.db"
-    
-    # Ensure data directory exists
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    
-    # Use check_same_thread=False to allow connection across threads
-    # However, you need to be careful with concurrent writes
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-    try:
-        yield conn
-    finally:
-        conn.close()
+async def sql_timing_middleware(request: Request, call_next):
+    """Report the request's statement count and DB time (see sql_stats.py)"""
+    with sql_stats.track(f"{request.method} {request.url.path}") as stats:
+        response = await call_next(request)
+    response.headers["Server-Timing"] = stats.server_timing()
+    response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+# Only installed when SQL_STATS=1, so it costs nothing otherwise
+if sql_stats.SQL_STATS_ENABLED:
+    app.middleware("http")(sql_timing_middleware)
 
 # Security configuration
 SECRET_KEY = "perfectreunionhackathonsecretkey2025"  # Change in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
-# Password hasher
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Comma-separated list of users allowed to call the admin/batch endpoints
+ADMIN_EMAILS = {email.strip() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Images are immutable per id (a new image gets a new id)
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Bytes read from an image BLOB at a time; bounds the memory per image request
+IMAGE_CHUNK_SIZE = int(os.environ.get("IMAGE_CHUNK_SIZE", 64 * 1024))
+
+# Password hashing (bcrypt in a process pool) is in passwords.py
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- Models ---
@@ -103,16 +162,20 @@ class Flight(BaseModel):
 
 class Vote(BaseModel):
     city: str
-    value: int  # 0 or 1
+    value: int = Field(..., ge=0, le=1)  # 0 or 1
 
-# --- Helper Functions ---
+class VoteBatch(BaseModel):
+    votes: List[Vote] = Field(..., min_length=1, max_length=500)
 
-def verify_password(plain_password, hashed_password):
-    # Use password hasher to verify password
-    # For this demo, we use a simple hash
-    import hashlib
-    hashed = hashlib.sha256(plain_password.encode()).hexdigest()
-    return hashed == hashed_password
+class BatchRecommendationRequest(BaseModel):
+    emails: List[str] = Field(..., min_length=1, max_length=1000)
+    limit: int = Field(10, ge=1, le=30)
+
+class BatchRecommendationResponse(BaseModel):
+    recommendations: Dict[str, List[City]]
+    missing: List[str]  # Requested emails with no user
+
+# --- Helper Functions ---
 
 def get_user(conn, email: str):
     cursor = conn.cursor()
@@ -122,12 +185,17 @@ def get_user(conn, email: str):
         return dict(user)
     return None
 
-def authenticate_user(conn, email: str, password: str):
-    user = get_user(conn, email)
+async def authenticate_user(email: str, password: str):
+    user = await db.run(get_user, email)
     if not user:
         return False
-    if not verify_password(password, user["password"]):
+    valid, new_hash = await passwords.verify_and_update(password, user["password"])
+    if not valid:
         return False
+    if new_hash is not None:
+        # Legacy SHA-256 (or lower-cost bcrypt) hash: store the replacement
+        await writer.run(update_password_hash, email, user["password"], new_hash)
+        user_cache.cache.invalidate(email)
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -140,7 +208,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), conn = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -153,309 +221,465 @@ async def get_current_user(token: str = Depends(oauth2_scheme), conn = Depends(g
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = get_user(conn, email=email)
+    
+    # Most requests are answered from the cache without a database connection
+    expires = payload.get("exp")
+    user = user_cache.cache.get(email, expires)
     if user is None:
-        raise credentials_exception
+        version = user_cache.cache.version()
+        user = await db.run(get_user, email)
+        if user is None:
+            raise credentials_exception
+        user_cache.cache.put(email, expires, user, version)
     return user
 
-# Recommendation system function
-def calculate_cosine_similarity(user_vector, city_vector):
-    """Calculate cosine similarity between user preferences and city attributes"""
-    # Handle case when vectors are all zeros
-    if sum(user_vector) == 0 or sum(city_vector) == 0:
-        return 0
-    return 1 - cosine(user_vector, city_vector)  # 1 - cosine distance = cosine similarity
+async def get_current_admin(current_user = Depends(get_current_user)):
+    if current_user["email"] not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return current_user
+
+# Recommendation system functions
+def get_user_importance_vector(conn, user_email, matrix=None):
+    """Get a user's importance values as a vector in city matrix category order (NaN where unset)"""
+    if matrix is None:
+        matrix = recommender.get_city_matrix(conn)
+    version = preference_cache.cache.version()
+    vector = preference_cache.cache.get(user_email, matrix.categories)
+    if vector is None:
+        cursor = conn.cursor()
+        cursor.execute("SELECT category, importance FROM ImportanceUC WHERE email = ?", (user_email,))
+        vector = np.full(len(matrix.categories), np.nan)
+        for row in cursor.fetchall():
+            i = matrix.category_index.get(row["category"])
+            if i is not None:
+                vector[i] = row["importance"]
+        preference_cache.cache.put(user_email, matrix.categories, vector, version)
+    return vector
 
-def get_user_category_importance(conn, user_email):
+def get_user_category_importance(conn, user_email, matrix=None):
     """Get importance values for all categories for a user"""
-    cursor = conn.cursor()
-    cursor.execute("SELECT category, importance FROM ImportanceUC WHERE email = ?", (user_email,))
-    return {row["category"]: row["importance"] for row in cursor.fetchall()}
+    if matrix is None:
+        matrix = recommender.get_city_matrix(conn)
+    vector = get_user_importance_vector(conn, user_email, matrix)
+    return {category: float(value) for category, value in zip(matrix.categories, vector) if not np.isnan(value)}
 
-def get_city_category_values(conn, city_name):
-    """Get category values for a city"""
-    cursor = conn.cursor()
-    cursor.execute("SELECT category, value, descr FROM CityCateg WHERE city = ?", (city_name,))
-    return [(row["category"], row["value"], row["descr"]) for row in cursor.fetchall()]
+# Cities (or emails) per IN (...) query, well below SQLite's bound parameter limit
+HYDRATION_CHUNK_SIZE = 500
 
-def get_categories(conn):
-    """Get all categories from database"""
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM Category")
-    return [row["name"] for row in cursor.fetchall()]
+def fetch_city_details(conn, city_names):
+    """Categories and image ids of many cities, with one query per table.
 
-def get_recommended_cities(conn, user_email, limit=10):
-    """Get recommended cities for a user based on their preferences"""
-    # Get user's category importance values
-    user_importance = get_user_category_importance(conn, user_email)
-    
-    # Get all categories
-    all_categories = get_categories(conn)
-    
-    # Get all cities
+    Returns {city: (categories, image_ids)}; categories are dicts with
+    category, value and descr, ordered by category name, and image ids
+    follow the images' order.
+    """
+    city_names = list(dict.fromkeys(city_names))
+    details = {city_name: ([], []) for city_name in city_names}
     cursor = conn.cursor()
-    cursor.execute("SELECT name FROM City")
-    cities = [row["name"] for row in cursor.fetchall()]
-    
-    # Get cities user has already voted on
-    cursor.execute("SELECT city FROM VoteUC WHERE email = ?", (user_email,))
-    voted_cities = [row["city"] for row in cursor.fetchall()]
-    
-    # Filter out cities user has already voted on
-    cities_to_score = [city for city in cities if city not in voted_cities]
-    
-    # Calculate similarity scores
-    city_scores = []
-    for city in cities_to_score:
-        city_values = {}
-        for category, value, _ in get_city_category_values(conn, city):
-            city_values[category] = value
-        
-        # Create vectors with same order for user and city
-        user_vector = [user_importance.get(category, 5) for category in all_categories]
-        city_vector = [city_values.get(category, 5) for category in all_categories]
-        
-        # Calculate similarity
-        similarity = calculate_cosine_similarity(user_vector, city_vector)
-        city_scores.append((city, similarity))
-    
-    # Sort by similarity score (descending)
-    city_scores.sort(key=lambda x: x[1], reverse=True)
-    
-    # Return top N cities
-    top_cities = []
-    for city_name, _ in city_scores[:limit]:
-        # Get city categories with values and descriptions
-        categories = []
-        for category, value, descr in get_city_category_values(conn, city_name):
-            categories.append({
-                "category": category,
-                "value": value,
-                "descr": descr
+    for start in range(0, len(city_names), HYDRATION_CHUNK_SIZE):
+        chunk = city_names[start:start + HYDRATION_CHUNK_SIZE]
+        placeholders = ','.join('?' for _ in chunk)
+        cursor.execute(
+            f"SELECT city, category, value, descr FROM CityCateg WHERE city IN ({placeholders}) ORDER BY city, category",
+            chunk
+        )
+        for row in cursor.fetchall():
+            details[row["city"]][0].append({
+                "category": row["category"],
+                "value": row["value"],
+                "descr": row["descr"]
             })
+        cursor.execute(
+            f"SELECT city_name, id FROM Image WHERE city_name IN ({placeholders}) ORDER BY city_name, \"order\"",
+            chunk
+        )
+        for row in cursor.fetchall():
+            details[row["city_name"]][1].append(row["id"])
+    return details
+
+def hydrate_cities(conn, city_names, importance=None, details=None):
+    """Build City payloads, ordering each city's categories by importance if given.
+
+    Callers hydrating several lists can pass `details` from fetch_city_details
+    to share one fetch.
+    """
+    if details is None:
+        details = fetch_city_details(conn, city_names)
+    top_cities = []
+    for city_name in city_names:
+        categories, image_ids = details[city_name]
         
-        # Sort categories by importance to the user
-        categories.sort(key=lambda x: user_importance.get(x["category"], 0), reverse=True)
-        
-        # Fetch image ID for the city
-        image_ids = fetch_image_id_for_city(conn, city_name) # Fetch image_ids
+        # Sort categories by importance
+        if importance is not None:
+            categories = sorted(categories, key=lambda x: importance.get(x["category"], 0), reverse=True)
         
         top_cities.append({
             "name": city_name,
             "categories": categories,
-            "image_ids": image_ids # Include image_ids
+            "image_ids": image_ids
         })
     
     return top_cities
 
-def get_group_recommended_cities(conn, group_code, limit=10):
-    """Get recommended cities for a group based on members' preferences"""
+def rank_user_cities(conn, user_email, limit=10, after=None, nprobe=None, engine=None):
+    """Rank cities for a user; returns (city, score) pairs.
+    
+    `after` is a (score, city) pagination key and `nprobe` the ANN
+    recall/latency knob passed to CityMatrix.rank. `engine` is "content",
+    "cf" or "blend" (default: recommender.ENGINE); users the CF model knows
+    nothing about are always ranked by content.
+    """
+    # Shared city x category matrix (reloaded only when the catalog changes)
+    matrix = recommender.get_city_matrix(conn)
+    
+    # Get user's category importance values
+    user_importance = get_user_category_importance(conn, user_email, matrix)
+    
+    # Get cities user has already voted on
     cursor = conn.cursor()
+    cursor.execute("SELECT city FROM VoteUC WHERE email = ?", (user_email,))
+    voted_cities = [row["city"] for row in cursor.fetchall()]
     
-    # Get group members
-    cursor.execute("SELECT email FROM UGroup WHERE code = ?", (group_code,))
-    members = [row["email"] for row in cursor.fetchall()]
+    # Score every city at once, excluding the ones already voted on
+    user_vector = matrix.vector(user_importance)
+    exclude = matrix.mask(voted_cities)
+    
+    engine = engine or recommender.ENGINE
+    if engine != "content":
+        model = collaborative.get_model(conn)
+        cf_scores = model.scores(user_email, matrix.cities) if model else None
+        if cf_scores is not None:
+            if engine == "cf":
+                scores = np.nan_to_num(cf_scores, nan=-np.inf)
+            else:
+                scores = recommender.blend(matrix.score(user_vector), cf_scores)
+            return matrix.rank_by_scores(scores, exclude=exclude, limit=limit, after=after)
+    
+    return matrix.rank(user_vector, exclude=exclude, limit=limit, after=after, nprobe=nprobe)
+
+def get_group_importance(conn, group_code):
+    """Average importance per category over a group's members, or None if it has none"""
+    # Maintained incrementally, see group_centroids.py
+    avg_importance = group_centroids.get_centroid(conn, group_code)
+    if avg_importance is None:
+        # Group predates centroids (or was edited outside the API): rebuild it once
+        writer.execute(group_centroids.rebuild, group_code)
+        avg_importance = group_centroids.get_centroid(conn, group_code)
+    return avg_importance
+
+def rank_group_cities(conn, group_code, limit=10, after=None, nprobe=None):
+    """Rank cities for a group based on members' preferences; returns (city, score) pairs"""
+    avg_importance = get_group_importance(conn, group_code)
     
-    if not members:
+    # Group has no members
+    if avg_importance is None:
         return []
     
-    # Get all categories
-    all_categories = get_categories(conn)
+    # Score every city against the group vector
+    matrix = recommender.get_city_matrix(conn)
+    group_vector = matrix.vector(avg_importance, default=0)
+    return matrix.rank(group_vector, limit=limit, after=after, nprobe=nprobe)
+
+# Materialized recommendations, refreshed in the background (see recommendation_refresher.py)
+refresher = recommendation_refresher.RecommendationRefresher(
+    connect_db, rank_user_cities, rank_group_cities, execute=writer.execute
+)
+
+def get_recommended_cities_page(conn, user_email, limit=10, page_cursor=None, nprobe=None, fresh=False):
+    """Get one page of recommended cities for a user and the cursor for the next page.
+
+    fresh skips the materialized ranking (the user's votes were just applied).
+    """
+    after = recommender.decode_cursor(page_cursor) if page_cursor else None
     
-    # Calculate average importance for each category
-    avg_importance = {category: 0 for category in all_categories}
-    for member in members:
-        member_importance = get_user_category_importance(conn, member)
-        for category, importance in member_importance.items():
-            avg_importance[category] += importance / len(members)
+    # Serve the materialized ranking when it is fresh enough, otherwise compute it
+    # (one extra result tells us whether there is a next page)
+    city_scores = None
+    if nprobe is None and not fresh:
+        city_scores = refresher.read_user(conn, user_email, limit + 1, after)
+    if city_scores is None:
+        city_scores = rank_user_cities(conn, user_email, limit + 1, after, nprobe)
+    next_cursor = recommender.encode_cursor(*city_scores[limit - 1]) if len(city_scores) > limit else None
     
-    # Get all cities
-    cursor.execute("SELECT name FROM City")
-    cities = [row["name"] for row in cursor.fetchall()]
-    
-    # Calculate similarity scores for group
-    city_scores = []
-    for city in cities:
-        city_values = {}
-        for category, value, _ in get_city_category_values(conn, city):
-            city_values[category] = value
-        
-        # Create vectors with same order for group and city
-        group_vector = [avg_importance.get(category, 5) for category in all_categories]
-        city_vector = [city_values.get(category, 5) for category in all_categories]
-        
-        # Calculate similarity
-        similarity = calculate_cosine_similarity(group_vector, city_vector)
-        city_scores.append((city, similarity))
+    # Return top N cities
+    user_importance = get_user_category_importance(conn, user_email)
+    top_cities = hydrate_cities(conn, [city for city, _ in city_scores[:limit]], user_importance)
+    return top_cities, next_cursor
+
+def get_group_recommended_cities_page(conn, group_code, limit=10, page_cursor=None, nprobe=None):
+    """Get one page of recommended cities for a group and the cursor for the next page"""
+    after = recommender.decode_cursor(page_cursor) if page_cursor else None
+    
+    city_scores = None
+    if nprobe is None:
+        city_scores = refresher.read_group(conn, group_code, limit + 1, after)
+    if city_scores is None:
+        city_scores = rank_group_cities(conn, group_code, limit + 1, after, nprobe)
+    next_cursor = recommender.encode_cursor(*city_scores[limit - 1]) if len(city_scores) > limit else None
+    
+    # Return top N cities, categories sorted by average importance to the group
+    avg_importance = get_group_importance(conn, group_code) or {}
+    top_cities = hydrate_cities(conn, [city for city, _ in city_scores[:limit]], avg_importance)
+    return top_cities, next_cursor
+
+def get_batch_recommended_cities(conn, user_emails, limit=10):
+    """Get recommended cities for many users at once.
     
-    # Sort by similarity score (descending)
-    city_scores.sort(key=lambda x: x[1], reverse=True)
+    Returns ({email: cities}, missing emails). Queued votes that have not
+    been applied yet are not reflected; the endpoint flushes them first.
+    """
+    user_emails = list(dict.fromkeys(user_emails))
+    cursor = conn.cursor()
     
-    # Return top N cities
-    top_cities = []
-    for city_name, _ in city_scores[:limit]:
-        # Get city categories with values and descriptions
-        categories = []
-        for category, value, descr in get_city_category_values(conn, city_name):
-            categories.append({
-                "category": category,
-                "value": value,
-                "descr": descr
-            })
-        
-        # Sort categories by average importance to the group
-        categories.sort(key=lambda x: avg_importance.get(x["category"], 0), reverse=True)
-        
-        # Fetch image ID for the city
-        image_ids = fetch_image_id_for_city(conn, city_name) # Fetch image_ids
-        
-        top_cities.append({
-            "name": city_name,
-            "categories": categories,
-            "image_ids": image_ids # Include image_ids
-        })
+    # Unknown emails would otherwise get rankings built from the default importance
+    known = set()
+    for start in range(0, len(user_emails), HYDRATION_CHUNK_SIZE):
+        chunk = user_emails[start:start + HYDRATION_CHUNK_SIZE]
+        cursor.execute(f"SELECT email FROM User WHERE email IN ({','.join('?' for _ in chunk)})", chunk)
+        known.update(row["email"] for row in cursor.fetchall())
+    missing = [email for email in user_emails if email not in known]
+    user_emails = [email for email in user_emails if email in known]
+    if not user_emails:
+        return {}, missing
+    
+    matrix = recommender.get_city_matrix(conn)
+    
+    # Load every user's importance values and voted cities, one query per table and chunk
+    importances = {email: {} for email in user_emails}
+    voted = np.zeros((len(user_emails), len(matrix.cities)), dtype=bool)
+    user_index = {email: i for i, email in enumerate(user_emails)}
+    for start in range(0, len(user_emails), HYDRATION_CHUNK_SIZE):
+        chunk = user_emails[start:start + HYDRATION_CHUNK_SIZE]
+        placeholders = ','.join('?' for _ in chunk)
+        cursor.execute(
+            f"SELECT email, category, importance FROM ImportanceUC WHERE email IN ({placeholders})",
+            chunk
+        )
+        for row in cursor.fetchall():
+            importances[row["email"]][row["category"]] = row["importance"]
+        cursor.execute(
+            f"SELECT email, city FROM VoteUC WHERE email IN ({placeholders})",
+            chunk
+        )
+        for row in cursor.fetchall():
+            city_index = matrix.city_index.get(row["city"])
+            if city_index is not None:
+                voted[user_index[row["email"]], city_index] = True
+    
+    # Score all users against all cities with one matrix-matrix product
+    user_vectors = np.stack([matrix.vector(importances[email]) for email in user_emails])
+    rankings = matrix.rank_many(user_vectors, exclude=voted, limit=limit)
+    
+    # Fetch every recommended city once, then order its categories per user
+    city_details = fetch_city_details(conn, [city_name for ranking in rankings for city_name, _ in ranking])
+    
+    results = {}
+    for email, ranking in zip(user_emails, rankings):
+        results[email] = hydrate_cities(
+            conn, [city_name for city_name, _ in ranking], importances[email], city_details
+        )
     
-    return top_cities
+    return results, missing
 
-def update_user_importance(conn, user_email, city, vote_value):
-    """Update user's category importance based on vote"""
-    # Learning rate determines how much a single vote affects importance
-    learning_rate = 0.1
+def update_user_importance_batch(conn, user_email, votes):
+    """Update user's category importance for a sequence of (city, vote value) votes.
     
-    # Get user's current importance values
-    user_importance = get_user_category_importance(conn, user_email)
-    
-    # Get city's category values
-    city_values = {}
-    for category, value, _ in get_city_category_values(conn, city):
-        city_values[category] = value
+    The votes are folded in order into one new vector, which is written to
+    ImportanceUC in the caller's transaction and to the preference cache, so
+    the next recommendation needs no DB read.
+    """
+    matrix = recommender.get_city_matrix(conn)
+    city_indices = [matrix.city_index[city] for city, _ in votes if city in matrix.city_index]
+    vote_values = [value for city, value in votes if city in matrix.city_index]
+    if not city_indices:
+        return
+    
+    # Move importance towards (like) or away from (dislike) each city's values
+    current_importance = get_user_importance_vector(conn, user_email, matrix)
+    new_importance = recommender.apply_votes(
+        current_importance, matrix.values[city_indices], matrix.present[city_indices], vote_values
+    )
     
-    # Update importance values based on vote
+    # Upsert only the categories the cities have
+    touched = np.flatnonzero(matrix.present[city_indices].any(axis=0))
     cursor = conn.cursor()
-    for category, city_value in city_values.items():
-        current_importance = user_importance.get(category, 5)
-        
-        # Calculate difference
-        difference = city_value - current_importance
-        
-        # Update importance based on vote
-        if vote_value == 1:  # Like
-            new_importance = current_importance + learning_rate * difference
-        else:  # Dislike
-            new_importance = current_importance - learning_rate * difference
-        
-        # Ensure importance stays within [0, 10]
-        new_importance = max(1, min(10, new_importance))
-        
-        # Update database
-        cursor.execute("""
-        UPDATE ImportanceUC SET importance = ? WHERE email = ? AND category = ?
-        """, (new_importance, user_email, category))
-        
-        # If not exists, insert
-        if cursor.rowcount == 0:
-            cursor.execute("""
-            INSERT INTO ImportanceUC (email, category, importance) VALUES (?, ?, ?)
-            """, (user_email, category, new_importance))
+    cursor.executemany("""
+    INSERT INTO ImportanceUC (email, category, importance) VALUES (?, ?, ?)
+    ON CONFLICT(email, category) DO UPDATE SET importance = excluded.importance
+    """, [(user_email, matrix.categories[i], float(new_importance[i])) for i in touched])
+    
+    # Keep the centroids of the user's groups in step
+    group_centroids.apply_delta(conn, user_email, matrix.categories, current_importance, new_importance)
+    
+    preference_cache.cache.put(user_email, matrix.categories, new_importance)
 
-def fetch_categories_for_city(conn, city_name):
+def record_votes(conn, user_email, votes):
+    """Store (city, value) votes and learn from them, in order; the caller commits"""
     cursor = conn.cursor()
-    cursor.execute("SELECT category, value, descr FROM CityCateg WHERE city = ?", (city_name,))
-    return [dict(row) for row in cursor.fetchall()] # Return list of dicts matching CityCategory
+    
+    # Insert or update every vote (later votes for the same city win)
+    cursor.executemany("""
+    INSERT INTO VoteUC (email, city, value) VALUES (?, ?, ?)
+    ON CONFLICT(email, city) DO UPDATE SET value = excluded.value
+    """, [(user_email, city, value) for city, value in votes])
+    
+    # Fold all votes into the importance values at once
+    update_user_importance_batch(conn, user_email, votes)
+    
+    # Re-fit the user's collaborative-filtering factors
+    collaborative.fold_in_user(conn, user_email)
 
-def fetch_image_id_for_city(conn, city_name):
+def mark_recommendations_dirty(conn, user_email):
+    """Queue a refresh of the user's and their groups' materialized recommendations"""
+    refresher.mark_user_dirty(user_email)
     cursor = conn.cursor()
-    cursor.execute("SELECT id FROM Image WHERE city_name = ? AND \"order\" = 1", (city_name,))
-    result = cursor.fetchone()
-    return [result["id"]] if result else []
+    cursor.execute("SELECT code FROM UGroup WHERE email = ?", (user_email,))
+    for row in cursor.fetchall():
+        refresher.mark_group_dirty(row["code"])
+
+# Applies queued votes in the background (see vote_queue.py)
+vote_consumer = vote_queue.VoteQueueConsumer(
+    connect_db, record_votes,
+    on_applied=mark_recommendations_dirty,
+    on_failed=preference_cache.cache.invalidate,  # The cache must not run ahead of the DB
+    execute=writer.execute
+)
 
 # --- Image Helper Function --- 
-def get_image_from_db(conn: sqlite3.Connection, image_id: int):
-    """Fetches image data and content type directly using sqlite3 connection."""
+def get_image_from_db(conn: sqlite3.Connection, image_id: int, if_none_match: Optional[str] = None,
+                      range_header: Optional[str] = None, if_range: Optional[str] = None, size: str = "original"):
+    """Fetches an image's metadata and either its whole data (if the image cache takes it), its image store path
+    or the byte range to send and its first chunk."""
     cursor = conn.cursor()
-    cursor.execute("SELECT image_data, content_type FROM Image WHERE id = ?", (image_id,))
+    cursor.execute(
+        "SELECT content_type, sha256, storage, length(image_data) AS size FROM Image WHERE id = ?",
+        (image_id,)
+    )
     result = cursor.fetchone()
-    if result:
-      # Return as a simple dictionary or object
-      return {"image_data": result["image_data"], "content_type": result["content_type"]}
-    return None
+    if result is None:
+        return None
+    variant = None
+    if size != "original":
+        cursor.execute("SELECT sha256, content_type FROM ImageVariant WHERE image_id = ? AND size = ?", (image_id, size))
+        variant = cursor.fetchone()
+        # Until its variants are built (see image_variants.py) the original is served
+        if variant is not None:
+            result = {"content_type": variant["content_type"], "sha256": variant["sha256"], "storage": "file", "size": None}
+    image = {
+        "content_type": result["content_type"],
+        # Not backfilled yet (see migrations.py): hash it chunk by chunk
+        "etag": f'"{result["sha256"] or image_sha256(conn, image_id)}"',
+        "size": result["size"],
+        # What is actually served, for image_cache.py
+        "cache_key": (image_id, size if variant is not None else "original"),
+        "data": None,
+        "path": None,
+        "not_modified": False,
+        "range": None,
+        "first_chunk": b"",
+    }
+    # The client already has these bytes: skip reading the BLOB
+    if etag_matches(if_none_match, image["etag"]):
+        image["not_modified"] = True
+        return image
+    # In the image store: served from the file (FileResponse handles Range)
+    if result["storage"] == "file":
+        path = image_store.store.path(result["sha256"])
+        try:
+            file_size = os.path.getsize(path)
+        except OSError:
+            raise HTTPException(status_code=404, detail="Image file missing from the image store")
+        # Small enough for the hot image cache: load it whole
+        if image_cache.cache.admits(file_size):
+            with open(path, "rb") as f:
+                image["data"] = f.read()
+        else:
+            image["path"] = path
+        return image
+    if image_cache.cache.admits(image["size"]):
+        image["data"] = read_image_chunk(conn, image_id, 0, image["size"])
+        return image
+    image["range"] = requested_range(range_header, if_range, image["etag"], image["size"])
+    start, end = image["range"] or (0, image["size"] - 1)
+    image["first_chunk"] = read_image_chunk(conn, image_id, start, min(IMAGE_CHUNK_SIZE, end + 1 - start))
+    return image
 
-# --- API Endpoints ---
+def read_image_chunk(conn: sqlite3.Connection, image_id: int, offset: int, length: int):
+    """Reads length bytes of an image at offset with incremental BLOB I/O"""
+    if length <= 0:
+        return b""
+    with conn.blobopen("Image", "image_data", image_id, readonly=True) as blob:
+        blob.seek(offset)
+        return blob.read(length)
 
-@app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), conn = Depends(get_db)):
-    user = authenticate_user(conn, form_data.username, form_data.password)
-    if not user:
+def image_sha256(conn: sqlite3.Connection, image_id: int):
+    """Hex SHA-256 of an image, read in chunks"""
+    digest = hashlib.sha256()
+    with conn.blobopen("Image", "image_data", image_id, readonly=True) as blob:
+        while chunk := blob.read(IMAGE_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def requested_range(range_header: Optional[str], if_range: Optional[str], etag: str, size: int):
+    """The byte range to send, or None for the whole image"""
+    # A Range only applies if the client's partial copy is this version (If-Range)
+    if range_header and (not if_range or if_range.strip() == etag):
+        return parse_byte_range(range_header, size)
+    return None
+
+def parse_byte_range(range_header: str, size: int):
+    """(start, end) of a single "bytes=" range, or None to send the whole image"""
+    unit, _, spec = range_header.partition("=")
+    first, dash, last = spec.strip().partition("-")
+    # Multiple ranges and other units are allowed to be ignored
+    if unit.strip().lower() != "bytes" or "," in spec or not dash:
+        return None
+    try:
+        if first.strip():
+            start = int(first)
+            end = size - 1
+            if last.strip():
+                # An invalid range (last < first) is ignored, one past the end is clipped
+                if int(last) < start:
+                    return None
+                end = min(int(last), size - 1)
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            start, end = max(size - suffix, 0), size - 1
+            if suffix <= 0:
+                start = size
+    except ValueError:
+        return None
+    if start >= size:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user["email"]}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return start, end
 
-@app.post("/users", response_model=User)
-async def create_user(user: UserCreate, conn = Depends(get_db)):
-    cursor = conn.cursor()
-    
-    # Check if email already exists
-    cursor.execute("SELECT * FROM User WHERE email = ?", (user.email,))
-    if cursor.fetchone():
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Check if username already exists
-    cursor.execute("SELECT * FROM User WHERE username = ?", (user.username,))
-    if cursor.fetchone():
-        raise HTTPException(status_code=400, detail="Username already taken")
-    
-    # Hash password
-    import hashlib
-    hashed_password = hashlib.sha256(user.password.encode()).hexdigest()
-    
-    # Insert user
-    cursor.execute(
-        "INSERT INTO User (email, username, password) VALUES (?, ?, ?)",
-        (user.email, user.username, hashed_password)
-    )
-    
-    # Set default importance values for all categories
-    cursor.execute("SELECT name FROM Category")
-    categories = [row["name"] for row in cursor.fetchall()]
-    
-    for category in categories:
-        cursor.execute(
-            "INSERT INTO ImportanceUC (email, category, importance) VALUES (?, ?, ?)",
-            (user.email, category, 5)  # Default neutral importance
-        )
-    
-    conn.commit()
-    
-    return {"email": user.email, "username": user.username}
+def etag_matches(if_none_match: Optional[str], etag: str):
+    """If-None-Match check (weak comparison, as RFC 9110 requires for it)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
 
-@app.get("/users/me", response_model=User)
-async def read_users_me(current_user = Depends(get_current_user)):
-    return {"email": current_user["email"], "username": current_user["username"]}
+# --- Read Queries (run on the reader pool as fn(conn, ...); see db_async.py) ---
 
-@app.get("/cities", response_model=List[str])
-async def get_cities(conn = Depends(get_db)):
+def get_city_names(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM City")
     return [row["name"] for row in cursor.fetchall()]
 
-@app.get("/cities/evaluation", response_model=List[City])
-async def get_cities_for_evaluation(
-    current_user = Depends(get_current_user),
-    conn = Depends(get_db),
-    limit: int = Query(5, ge=1, le=10)
-):
-    """Get cities for initial evaluation (those not yet voted by the user)"""
+def get_evaluation_cities(conn, user_email, limit):
+    """Random cities the user has not voted on yet, with their details"""
     cursor = conn.cursor()
     
     # Get cities user has already voted on
-    cursor.execute("SELECT city FROM VoteUC WHERE email = ?", (current_user["email"],))
+    cursor.execute("SELECT city FROM VoteUC WHERE email = ?", (user_email,))
     voted_cities = [row["city"] for row in cursor.fetchall()]
     
     # Get cities not yet voted
@@ -477,88 +701,170 @@ async def get_cities_for_evaluation(
     selected_cities = random.sample(remaining_cities, min(limit, len(remaining_cities)))
     
     # Get city details
-    cities_data = []
-    for city_name in selected_cities:
-        # Fetch categories and image_id for city_name
-        categories = fetch_categories_for_city(conn, city_name) # Replace with actual fetching
-        image_ids = fetch_image_id_for_city(conn, city_name)   # Replace with actual fetching
-        cities_data.append({
-            "name": city_name,
-            "categories": categories,
-            "image_ids": image_ids
-        })
-    
-    return cities_data
+    return hydrate_cities(conn, selected_cities)
 
-@app.get("/cities/{city_name}", response_model=City)
-async def get_city(city_name: str, conn = Depends(get_db)):
+def get_city_details(conn, city_name):
     cursor = conn.cursor()
     # Check if city exists
-    cursor.execute("SELECT COUNT(*) FROM City WHERE name = ?", (city_name,))
-    if not cursor.fetchone():
-        raise HTTPException(status_code=404, detail="City not found")
+    cursor.execute("SELECT 1 FROM City WHERE name = ?", (city_name,))
+    if cursor.fetchone() is None:
+        return None
     
     # Fetch categories and image_id
-    categories = fetch_categories_for_city(conn, city_name) # Replace with actual fetching
-    image_ids = fetch_image_id_for_city(conn, city_name)   # Replace with actual fetching
-    return {"name": city_name, "categories": categories, "image_ids": image_ids}
+    return hydrate_cities(conn, [city_name])[0]
 
-@app.get("/recommendations", response_model=List[City], tags=["Recommendations"])
-async def get_recommendations(
-    current_user = Depends(get_current_user),
-    conn = Depends(get_db),
-    limit: int = Query(10, ge=1, le=30)
-):
-    return get_recommended_cities(conn, current_user["email"], limit)
+def get_missing_cities(conn, city_names):
+    """The subset of city_names that are not in the City table"""
+    cities = list(set(city_names))
+    cursor = conn.cursor()
+    placeholders = ','.join('?' for _ in cities)
+    cursor.execute(f"SELECT name FROM City WHERE name IN ({placeholders})", cities)
+    return set(cities) - {row["name"] for row in cursor.fetchall()}
 
-@app.post("/cities/vote")
-async def vote_city(
-    vote: Vote,
-    current_user = Depends(get_current_user),
-    conn = Depends(get_db)
-):
+def get_group_members(conn, group_code):
+    cursor = conn.cursor()
+    # In join order (the creator first)
+    cursor.execute("SELECT email FROM UGroup WHERE code = ? ORDER BY rowid", (group_code,))
+    return [row["email"] for row in cursor.fetchall()]
+
+def fetch_user_groups(conn, user_email):
+    """Groups the user is in, with their members"""
     cursor = conn.cursor()
     
-    # Check if city exists
-    cursor.execute("SELECT * FROM City WHERE name = ?", (vote.city,))
+    # Groups the user is in joined with all of their members, in one query
+    cursor.execute("""
+    SELECT mine.code, member.email
+    FROM UGroup mine
+    JOIN UGroup member ON member.code = mine.code
+    WHERE mine.email = ?
+    ORDER BY mine.code, member.rowid
+    """, (user_email,))
+    
+    groups = {}
+    for row in cursor.fetchall():
+        groups.setdefault(row["code"], []).append(row["email"])
+    
+    return [{"code": code, "members": members} for code, members in groups.items()]
+
+def check_group_member(conn, group_code, user_email):
+    """Raise 404 if the group does not exist and 403 if the user is not in it"""
+    cursor = conn.cursor()
+    
+    # Check if group exists
+    cursor.execute("SELECT * FROM GroupTable WHERE code = ?", (group_code,))
     if not cursor.fetchone():
-        raise HTTPException(status_code=404, detail="City not found")
+        raise HTTPException(status_code=404, detail="Group not found")
     
-    # Check if user has already voted for this city
+    # Check if user is in group
     cursor.execute(
-        "SELECT * FROM VoteUC WHERE email = ? AND city = ?",
-        (current_user["email"], vote.city)
+        "SELECT * FROM UGroup WHERE email = ? AND code = ?",
+        (user_email, group_code)
     )
+    if not cursor.fetchone():
+        raise HTTPException(status_code=403, detail="User not in group")
+
+def find_flights(conn, search):
+    if flight_index.FLIGHT_INDEX:
+        try:
+            return flight_index.get_flight_index(conn).search(
+                search.departure_city, search.min_date, search.max_date,
+                max_budget=search.max_budget, companies=search.companies
+            )
+        except ValueError:
+            pass  # Dates that are not ISO 8601: compare them as text in SQL
+    return find_flights_sql(conn, search)
+
+def find_flights_sql(conn, search):
+    cursor = conn.cursor()
+    
+    # Build query parameters
+    query = """
+    SELECT * FROM Flight 
+    WHERE depCity = ? 
+    AND depTime BETWEEN ? AND ?
+    """
+    params = [search.departure_city, search.min_date, search.max_date]
+    
+    # Add budget constraint if provided
+    if search.max_budget:
+        query += " AND cost <= ?"
+        params.append(search.max_budget)
+    
+    # Add companies filter if provided
+    if search.companies and len(search.companies) > 0:
+        query += " AND company IN ({})".format(','.join('?' for _ in search.companies))
+        params.extend(search.companies)
+    
+    # Execute query
+    cursor.execute(query, params)
+    
+    # Convert to list of Flight objects
+    flights = []
+    for row in cursor.fetchall():
+        flights.append({
+            "code": row["code"],
+            "cost": row["cost"],
+            "depCity": row["depCity"],
+            "arrCity": row["arrCity"],
+            "depTime": row["depTime"],
+            "timeDuration": row["timeDuration"],
+            "distance": row["distance"],
+            "planeModel": row["planeModel"],
+            "company": row["company"]
+        })
+    
+    return flights
+
+def get_flight_company_names(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM FlightCompany")
+    return [row["name"] for row in cursor.fetchall()]
+
+# --- Write Jobs (run on the writer thread as job(conn, ...); see db_writer.py) ---
+
+def insert_user(conn, user, hashed_password):
+    """Create a user with neutral importance for every category"""
+    cursor = conn.cursor()
+    
+    # Check if email already exists
+    cursor.execute("SELECT * FROM User WHERE email = ?", (user.email,))
     if cursor.fetchone():
-        # Update existing vote
-        cursor.execute(
-            "UPDATE VoteUC SET value = ? WHERE email = ? AND city = ?",
-            (vote.value, current_user["email"], vote.city)
-        )
-    else:
-        # Insert new vote
-        cursor.execute(
-            "INSERT INTO VoteUC (email, city, value) VALUES (?, ?, ?)",
-            (current_user["email"], vote.city, vote.value)
-        )
+        raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Update user importance values based on vote
-    update_user_importance(conn, current_user["email"], vote.city, vote.value)
+    # Check if username already exists
+    cursor.execute("SELECT * FROM User WHERE username = ?", (user.username,))
+    if cursor.fetchone():
+        raise HTTPException(status_code=400, detail="Username already taken")
     
-    conn.commit()
+    # Insert user
+    cursor.execute(
+        "INSERT INTO User (email, username, password) VALUES (?, ?, ?)",
+        (user.email, user.username, hashed_password)
+    )
     
-    return {"status": "success"}
+    # Set default importance values for all categories
+    cursor.execute("SELECT name FROM Category")
+    categories = [row["name"] for row in cursor.fetchall()]
+    
+    for category in categories:
+        cursor.execute(
+            "INSERT INTO ImportanceUC (email, category, importance) VALUES (?, ?, ?)",
+            (user.email, category, 5)  # Default neutral importance
+        )
 
-@app.post("/groups", response_model=Group)
-async def create_group(
-    group: GroupCreate,
-    current_user = Depends(get_current_user),
-    conn = Depends(get_db)
-):
+def update_password_hash(conn, email, old_hash, new_hash):
+    """Replace a user's password hash, unless it changed since old_hash was read"""
+    conn.execute(
+        "UPDATE User SET password = ? WHERE email = ? AND password = ?",
+        (new_hash, email, old_hash)
+    )
+
+def insert_group(conn, requested_code, user_email):
+    """Create a group (random code unless one was requested) with the user as first member"""
     cursor = conn.cursor()
     
     # Generate random code if not provided
-    if not group.code:
+    if not requested_code:
         # Get a random 4-digit code not already in use
         while True:
             code = random.randint(1000, 9999)
@@ -566,7 +872,7 @@ async def create_group(
             if not cursor.fetchone():
                 break
     else:
-        code = group.code
+        code = requested_code
         # Check if code already exists
         cursor.execute("SELECT * FROM GroupTable WHERE code = ?", (code,))
         if cursor.fetchone():
@@ -578,19 +884,16 @@ async def create_group(
     # Add creator to group
     cursor.execute(
         "INSERT INTO UGroup (email, code) VALUES (?, ?)",
-        (current_user["email"], code)
+        (user_email, code)
     )
     
-    conn.commit()
-    
-    return {"code": code, "members": [current_user["email"]]}
+    # Start the group centroid from the creator's preferences
+    matrix = recommender.get_city_matrix(conn)
+    group_centroids.add_member(conn, code, matrix.categories, get_user_importance_vector(conn, user_email, matrix))
+    return code
 
-@app.post("/groups/join", response_model=Group)
-async def join_group(
-    group_code: int = Body(..., embed=True),
-    current_user = Depends(get_current_user),
-    conn = Depends(get_db)
-):
+def insert_group_member(conn, group_code, user_email):
+    """Add a user to an existing group that is not full"""
     cursor = conn.cursor()
     
     # Check if group exists
@@ -601,7 +904,7 @@ async def join_group(
     # Check if user is already in group
     cursor.execute(
         "SELECT * FROM UGroup WHERE email = ? AND code = ?",
-        (current_user["email"], group_code)
+        (user_email, group_code)
     )
     if cursor.fetchone():
         raise HTTPException(status_code=400, detail="User already in group")
@@ -615,119 +918,202 @@ async def join_group(
     # Add user to group
     cursor.execute(
         "INSERT INTO UGroup (email, code) VALUES (?, ?)",
-        (current_user["email"], group_code)
+        (user_email, group_code)
     )
     
-    conn.commit()
+    # Fold the new member into the group centroid
+    matrix = recommender.get_city_matrix(conn)
+    group_centroids.add_member(conn, group_code, matrix.categories, get_user_importance_vector(conn, user_email, matrix))
+
+# --- API Endpoints ---
+
+@app.exception_handler(db_pool.PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: db_pool.PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": "Database busy, try again"})
+
+@app.post("/token", response_model=Token)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await authenticate_user(form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user["email"]}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@app.post("/users", response_model=User)
+async def create_user(user: UserCreate):
+    # Hash password (in the process pool, off the event loop)
+    hashed_password = await passwords.hash_password(user.password)
     
-    # Get all members
-    cursor.execute("SELECT email FROM UGroup WHERE code = ?", (group_code,))
-    members = [row["email"] for row in cursor.fetchall()]
+    # The existence checks run in the same serialized write as the insert
+    await writer.run(insert_user, user, hashed_password)
+    user_cache.cache.invalidate(user.email)
     
-    return {"code": group_code, "members": members}
+    return {"email": user.email, "username": user.username}
 
-@app.get("/groups", response_model=List[Group])
-async def get_user_groups(
+@app.get("/users/me", response_model=User)
+async def read_users_me(current_user = Depends(get_current_user)):
+    return {"email": current_user["email"], "username": current_user["username"]}
+
+@app.get("/cities", response_model=List[str])
+async def get_cities():
+    return await db.run(get_city_names)
+
+@app.get("/cities/evaluation", response_model=List[City])
+async def get_cities_for_evaluation(
     current_user = Depends(get_current_user),
-    conn = Depends(get_db)
+    limit: int = Query(5, ge=1, le=10)
 ):
-    cursor = conn.cursor()
+    """Get cities for initial evaluation (those not yet voted by the user)"""
+    await db.run(vote_consumer.flush_user, current_user["email"])
+    return await db.run(get_evaluation_cities, current_user["email"], limit)
+
+@app.get("/cities/{city_name}", response_model=City)
+async def get_city(city_name: str):
+    city = await db.run(get_city_details, city_name)
+    if city is None:
+        raise HTTPException(status_code=404, detail="City not found")
+    return city
+
+@app.get("/recommendations", response_model=List[City], tags=["Recommendations"])
+async def get_recommendations(
+    response: Response,
+    current_user = Depends(get_current_user),
+    limit: int = Query(10, ge=1, le=30),
+    page_cursor: Optional[str] = Query(None, alias="cursor", description="Value of X-Next-Cursor from the previous page")
+):
+    # Make sure the user's own queued votes are reflected
+    flushed = await db.run(vote_consumer.flush_user, current_user["email"])
+    try:
+        cities, next_cursor = await db.run(
+            get_recommended_cities_page, current_user["email"], limit, page_cursor, None, flushed > 0
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return cities
+
+@app.post("/admin/recommendations/batch", response_model=BatchRecommendationResponse, tags=["Recommendations"])
+async def get_batch_recommendations(
+    request: BatchRecommendationRequest,
+    current_user = Depends(get_current_admin)
+):
+    """Top recommendations for many users in one call (cache warming, emails).
     
-    # Get groups user is in
-    cursor.execute(
-        "SELECT code FROM UGroup WHERE email = ?",
-        (current_user["email"],)
-    )
-    group_codes = [row["code"] for row in cursor.fetchall()]
+    Emails with no user are listed in missing instead of ranked.
+    """
+    # Apply the users' queued votes so the rankings reflect them
+    for email in await db.run(vote_queue.pending_emails, request.emails):
+        await db.run(vote_consumer.flush_user, email)
+    recommendations, missing = await db.run(get_batch_recommended_cities, request.emails, request.limit)
+    return {"recommendations": recommendations, "missing": missing}
+
+@app.get("/admin/metrics", tags=["Admin"])
+async def get_metrics(current_user = Depends(get_current_admin)):
+    """In-process counters for the caches and background workers"""
+    return {
+        "db_pool": pool.stats(),
+        "db_writer": writer.stats(),
+        "flight_index": flight_index.stats(),
+        "image_cache": image_cache.cache.stats(),
+        "preference_cache": preference_cache.cache.stats(),
+        "recommendation_refresher": refresher.stats(),
+        "user_cache": user_cache.cache.stats(),
+        "vote_queue": await db.run(vote_consumer.stats),
+    }
+
+@app.post("/cities/vote")
+async def vote_city(
+    vote: Vote,
+    current_user = Depends(get_current_user)
+):
+    # Check if city exists
+    if await db.run(get_missing_cities, [vote.city]):
+        raise HTTPException(status_code=404, detail="City not found")
     
-    groups = []
-    for code in group_codes:
-        # Get members for each group
-        cursor.execute("SELECT email FROM UGroup WHERE code = ?", (code,))
-        members = [row["email"] for row in cursor.fetchall()]
-        
-        groups.append({
-            "code": code,
-            "members": members
-        })
+    # Queue the vote; it is applied in the background (or on the user's next read)
+    await writer.run(vote_queue.enqueue, current_user["email"], [(vote.city, vote.value)])
+    vote_consumer.notify()
+    
+    return {"status": "success"}
+
+@app.post("/cities/vote/batch")
+async def vote_cities_batch(
+    batch: VoteBatch,
+    current_user = Depends(get_current_user)
+):
+    """Queue several votes, in order, in a single transaction"""
+    # Check that every city exists before writing anything
+    missing = await db.run(get_missing_cities, [vote.city for vote in batch.votes])
+    if missing:
+        raise HTTPException(status_code=404, detail=f"City not found: {', '.join(sorted(missing))}")
     
-    return groups
+    await writer.run(vote_queue.enqueue, current_user["email"], [(vote.city, vote.value) for vote in batch.votes])
+    vote_consumer.notify()
+    
+    return {"status": "success", "count": len(batch.votes)}
+
+@app.post("/groups", response_model=Group)
+async def create_group(
+    group: GroupCreate,
+    current_user = Depends(get_current_user)
+):
+    code = await writer.run(insert_group, group.code, current_user["email"])
+    refresher.mark_group_dirty(code)
+    
+    return {"code": code, "members": [current_user["email"]]}
+
+@app.post("/groups/join", response_model=Group)
+async def join_group(
+    group_code: int = Body(..., embed=True),
+    current_user = Depends(get_current_user)
+):
+    await writer.run(insert_group_member, group_code, current_user["email"])
+    refresher.mark_group_dirty(group_code)
+    
+    members = await db.run(get_group_members, group_code)
+    return {"code": group_code, "members": members}
+
+@app.get("/groups", response_model=List[Group])
+async def get_user_groups(
+    current_user = Depends(get_current_user)
+):
+    return await db.run(fetch_user_groups, current_user["email"])
 
 @app.get("/groups/{group_code}/recommendations", response_model=List[City])
 async def get_group_recommendations(
     group_code: int,
+    response: Response,
     current_user = Depends(get_current_user),
-    conn = Depends(get_db),
-    limit: int = Query(10, ge=1, le=30)
+    limit: int = Query(10, ge=1, le=30),
+    page_cursor: Optional[str] = Query(None, alias="cursor", description="Value of X-Next-Cursor from the previous page")
 ):
-    cursor = conn.cursor()
-    
-    # Check if group exists
-    cursor.execute("SELECT * FROM GroupTable WHERE code = ?", (group_code,))
-    if not cursor.fetchone():
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    # Check if user is in group
-    cursor.execute(
-        "SELECT * FROM UGroup WHERE email = ? AND code = ?",
-        (current_user["email"], group_code)
-    )
-    if not cursor.fetchone():
-        raise HTTPException(status_code=403, detail="User not in group")
-    
-    return get_group_recommended_cities(conn, group_code, limit)
+    await db.run(check_group_member, group_code, current_user["email"])
+    try:
+        cities, next_cursor = await db.run(get_group_recommended_cities_page, group_code, limit, page_cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return cities
 
 @app.post("/flights/search", response_model=List[Flight])
 async def search_flights(
     search: FlightSearch,
-    current_user = Depends(get_current_user),
-    conn = Depends(get_db)
+    current_user = Depends(get_current_user)
 ):
-    cursor = conn.cursor()
-    
-    # Build query parameters
-    query = """
-    SELECT * FROM Flight 
-    WHERE depCity = ? 
-    AND depTime BETWEEN ? AND ?
-    """
-    params = [search.departure_city, search.min_date, search.max_date]
-    
-    # Add budget constraint if provided
-    if search.max_budget:
-        query += " AND cost <= ?"
-        params.append(search.max_budget)
-    
-    # Add companies filter if provided
-    if search.companies and len(search.companies) > 0:
-        query += " AND company IN ({})".format(','.join('?' for _ in search.companies))
-        params.extend(search.companies)
-    
-    # Execute query
-    cursor.execute(query, params)
-    
-    # Convert to list of Flight objects
-    flights = []
-    for row in cursor.fetchall():
-        flights.append({
-            "code": row["code"],
-            "cost": row["cost"],
-            "depCity": row["depCity"],
-            "arrCity": row["arrCity"],
-            "depTime": row["depTime"],
-            "timeDuration": row["timeDuration"],
-            "distance": row["distance"],
-            "planeModel": row["planeModel"],
-            "company": row["company"]
-        })
-    
-    return flights
+    return await db.run(find_flights, search)
 
 @app.get("/flight_companies", response_model=List[str])
-async def get_flight_companies(conn = Depends(get_db)):
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM FlightCompany")
-    return [row["name"] for row in cursor.fetchall()]
+async def get_flight_companies():
+    return await db.run(get_flight_company_names)
 
 @app.get("/images/{image_id}",
          response_class=Response,
@@ -736,19 +1122,84 @@ async def get_flight_companies(conn = Depends(get_db)):
                  "content": {"image/jpeg": {}, "image/png": {}, "image/webp": {}, "application/octet-stream": {}},
                  "description": "The image data."
              },
+             206: {"description": "The requested byte range (Range) of the image."},
+             304: {"description": "The client's cached copy (If-None-Match) is current"},
+             416: {"description": "The requested range is past the end of the image"},
              404: {"description": "Image not found"}
          },
          tags=["Images"]
         )
-def read_image(image_id: int, conn: sqlite3.Connection = Depends(get_db)):
-    # Use the helper function with the sqlite3 connection
-    db_image_data = get_image_from_db(conn, image_id=image_id)
+async def read_image(
+    image_id: int,
+    if_none_match: Optional[str] = Header(None),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    size: Literal["thumbnail", "card", "full", "original"] = "original",
+):
+    # Hot images are answered from memory (see image_cache.py)
+    cached = image_cache.cache.get((image_id, size))
+    if cached is not None:
+        data, content_type, etag = cached
+        headers = image_headers(etag)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return image_bytes_response(data, content_type, headers, range_header, if_range)
+    
+    db_image_data = await db.run(get_image_from_db, image_id, if_none_match, range_header, if_range, size)
     
     if db_image_data is None:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    # Return the binary data with the correct content type
-    return Response(content=db_image_data["image_data"], media_type=db_image_data["content_type"])
+    headers = image_headers(db_image_data["etag"])
+    if db_image_data["not_modified"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if db_image_data["data"] is not None:
+        image_cache.cache.put(db_image_data["cache_key"], db_image_data["data"], db_image_data["content_type"], db_image_data["etag"])
+        return image_bytes_response(db_image_data["data"], db_image_data["content_type"], headers, range_header, if_range)
+    if db_image_data["path"] is not None:
+        return FileResponse(db_image_data["path"], media_type=db_image_data["content_type"], headers=headers)
+    
+    total_bytes = db_image_data["size"]
+    start, end = db_image_data["range"] or (0, total_bytes - 1)
+    headers["Content-Length"] = str(end + 1 - start)
+    status_code = status.HTTP_200_OK
+    if db_image_data["range"] is not None:
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{total_bytes}"
+    
+    # Stream the binary data in chunks with the correct content type
+    first_chunk = db_image_data["first_chunk"]
+    return StreamingResponse(
+        stream_image(image_id, first_chunk, start + len(first_chunk), end),
+        status_code=status_code,
+        media_type=db_image_data["content_type"],
+        headers=headers,
+    )
+
+def image_headers(etag: str):
+    # An image id never changes content, so clients may keep it forever
+    return {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+def image_bytes_response(data: bytes, content_type: str, headers: dict, range_header: Optional[str], if_range: Optional[str]):
+    """A 200, or 206 for a Range, response for an image held in memory"""
+    byte_range = requested_range(range_header, if_range, headers["ETag"], len(data))
+    if byte_range is None:
+        return Response(content=data, media_type=content_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(content=data[start:end + 1], status_code=status.HTTP_206_PARTIAL_CONTENT,
+                    media_type=content_type, headers=headers)
+
+async def stream_image(image_id: int, first_chunk: bytes, offset: int, end: int):
+    """Yields the first chunk, then reads the rest one chunk (and connection checkout) at a time"""
+    if first_chunk:
+        yield first_chunk
+    while offset <= end:
+        chunk = await db.run(read_image_chunk, image_id, offset, min(IMAGE_CHUNK_SIZE, end + 1 - offset))
+        if not chunk:
+            break
+        yield chunk
+        offset += len(chunk)
 
 # Start the server with: uvicorn app:app --reload
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+"""
+Collaborative-filtering recommender trained on the VoteUC like/dislike matrix.
+
+Implicit-feedback matrix factorization (Hu, Koren & Volinsky, "Collaborative
+Filtering for Implicit Feedback Datasets") fitted with alternating least
+squares on a scipy.sparse CSR matrix. A like is preference 1 and a dislike
+preference 0, both observed with confidence 1 + alpha; every other city is
+preference 0 with confidence 1. Each ALS sweep costs O(votes * k^2 +
+(users + cities) * k^3), i.e. linear in the number of votes.
+
+Training runs offline (python collaborative.py train) and stores the factors
+in the UserFactor / CityFactor tables. New votes are folded in incrementally
+by re-solving only the voter's factors against the fixed city factors.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+import migrations
+
+CF_FACTORS = int(os.environ.get("CF_FACTORS", 16))
+CF_REGULARIZATION = float(os.environ.get("CF_REGULARIZATION", 0.1))
+CF_ALPHA = float(os.environ.get("CF_ALPHA", 10.0))
+CF_ITERATIONS = int(os.environ.get("CF_ITERATIONS", 10))
+# How often the server checks whether a newer model was trained
+CF_RELOAD_INTERVAL = float(os.environ.get("CF_RELOAD_INTERVAL", 60))
+
+
+def _solve(other, gram, indices, confidence, preference, regularization):
+    """Least-squares factors for one row given the other side's factors"""
+    k = other.shape[1]
+    rows = other[indices]
+    a = gram + (rows.T * (confidence - 1)) @ rows + regularization * np.eye(k, dtype=other.dtype)
+    b = rows.T @ (confidence * preference)
+    return np.linalg.solve(a, b)
+
+
+def _sweep(other, confidence, preference, regularization):
+    """Solve every row of a CSR confidence/preference pair against `other`"""
+    gram = other.T @ other
+    factors = np.zeros((confidence.shape[0], other.shape[1]), dtype=other.dtype)
+    for row in range(confidence.shape[0]):
+        start, end = confidence.indptr[row], confidence.indptr[row + 1]
+        if start == end:
+            continue
+        factors[row] = _solve(
+            other, gram, confidence.indices[start:end],
+            confidence.data[start:end], preference.data[start:end], regularization
+        )
+    return factors
+
+
+def train(votes, factors=CF_FACTORS, regularization=CF_REGULARIZATION, alpha=CF_ALPHA,
+          iterations=CF_ITERATIONS, seed=0):
+    """Fit user and city factors from (email, city, value) votes.
+
+    Returns (emails, cities, user_factors, city_factors).
+    """
+    emails = sorted({email for email, _, _ in votes})
+    cities = sorted({city for _, city, _ in votes})
+    user_index = {email: i for i, email in enumerate(emails)}
+    city_index = {city: i for i, city in enumerate(cities)}
+
+    rows = np.fromiter((user_index[email] for email, _, _ in votes), dtype=np.int64, count=len(votes))
+    cols = np.fromiter((city_index[city] for _, city, _ in votes), dtype=np.int64, count=len(votes))
+    liked = np.fromiter((value for _, _, value in votes), dtype=np.float32, count=len(votes))
+    shape = (len(emails), len(cities))
+
+    # Same sparsity pattern for both matrices, so their data arrays line up
+    confidence = sp.csr_matrix((np.full(len(votes), 1 + alpha, dtype=np.float32), (rows, cols)), shape=shape)
+    preference = sp.csr_matrix((liked, (rows, cols)), shape=shape)
+    for matrix in (confidence, preference):
+        matrix.sum_duplicates()
+        matrix.sort_indices()
+    confidence_t, preference_t = confidence.T.tocsr(), preference.T.tocsr()
+    for matrix in (confidence_t, preference_t):
+        matrix.sort_indices()
+
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(0, 0.01, size=(shape[0], factors)).astype(np.float32)
+    city_factors = rng.normal(0, 0.01, size=(shape[1], factors)).astype(np.float32)
+    for _ in range(iterations):
+        user_factors = _sweep(city_factors, confidence, preference, regularization)
+        city_factors = _sweep(user_factors, confidence_t, preference_t, regularization)
+
+    return emails, cities, user_factors, city_factors
+
+
+class FactorModel:
+    """Trained factors held in memory, with per-user fold-in"""
+
+    def __init__(self, trained_at, user_factors, cities, city_factors, regularization, alpha):
+        self.trained_at = trained_at
+        self.user_factors = user_factors  # email -> float32 vector
+        self.cities = list(cities)
+        self.city_index = {city: i for i, city in enumerate(self.cities)}
+        self.city_factors = np.asarray(city_factors, dtype=np.float32)
+        self.gram = self.city_factors.T @ self.city_factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self._aligned = (None, None)  # (city list, model row of each city)
+
+    @classmethod
+    def load(cls, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT trained_at, regularization, alpha FROM FactorModel WHERE id = 1")
+        info = cursor.fetchone()
+        if info is None:
+            return None
+        cursor.execute("SELECT city, factors FROM CityFactor ORDER BY city")
+        city_rows = cursor.fetchall()
+        cursor.execute("SELECT email, factors FROM UserFactor")
+        user_factors = {email: np.frombuffer(blob, dtype=np.float32) for email, blob in cursor.fetchall()}
+        city_factors = np.array([np.frombuffer(blob, dtype=np.float32) for _, blob in city_rows], dtype=np.float32)
+        return cls(info[0], user_factors, [city for city, _ in city_rows], city_factors, info[1], info[2])
+
+    def fold_in(self, votes):
+        """Factors for a user from their (city, value) votes, keeping city factors fixed"""
+        known = [(self.city_index[city], value) for city, value in votes if city in self.city_index]
+        if not known:
+            return None
+        indices = np.array([i for i, _ in known])
+        preference = np.array([value for _, value in known], dtype=np.float32)
+        confidence = np.full(len(known), 1 + self.alpha, dtype=np.float32)
+        return _solve(self.city_factors, self.gram, indices, confidence, preference, self.regularization).astype(np.float32)
+
+    def scores(self, user_email, cities):
+        """Predicted preference of the user for each of `cities` (NaN where unknown), or None"""
+        factors = self.user_factors.get(user_email)
+        if factors is None:
+            return None
+        # Map the caller's city order onto model rows once per city list
+        aligned_cities, positions = self._aligned
+        if aligned_cities is not cities:
+            positions = np.array([self.city_index.get(city, -1) for city in cities], dtype=np.int64)
+            self._aligned = (cities, positions)
+        predicted = np.full(len(cities), np.nan, dtype=np.float32)
+        known = positions >= 0
+        predicted[known] = self.city_factors[positions[known]] @ factors
+        return predicted
+
+
+_model = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_model(conn):
+    """The current factor model (None if never trained), reloaded after retraining"""
+    global _model, _checked_at
+    now = time.time()
+    if now - _checked_at < CF_RELOAD_INTERVAL:
+        return _model
+    with _lock:
+        if now - _checked_at >= CF_RELOAD_INTERVAL:
+            _checked_at = now
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT trained_at FROM FactorModel WHERE id = 1")
+            except sqlite3.OperationalError:
+                # Factor tables not created yet
+                return _model
+            row = cursor.fetchone()
+            if row is None:
+                _model = None
+            elif _model is None or _model.trained_at != row[0]:
+                _model = FactorModel.load(conn)
+        return _model
+
+
+def fold_in_user(conn, user_email):
+    """Refresh one user's factors from all of their votes; the caller commits"""
+    model = get_model(conn)
+    if model is None:
+        return
+    cursor = conn.cursor()
+    cursor.execute("SELECT city, value FROM VoteUC WHERE email = ?", (user_email,))
+    factors = model.fold_in([(row[0], row[1]) for row in cursor.fetchall()])
+    if factors is None:
+        return
+    cursor.execute("""
+    INSERT INTO UserFactor (email, factors) VALUES (?, ?)
+    ON CONFLICT(email) DO UPDATE SET factors = excluded.factors
+    """, (user_email, factors.tobytes()))
+    model.user_factors[user_email] = factors
+
+
+def train_and_store(conn, **options):
+    """Train on the whole VoteUC table and replace the stored model"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT email, city, value FROM VoteUC")
+    votes = cursor.fetchall()
+    if not votes:
+        return None
+    emails, cities, user_factors, city_factors = train(votes, **options)
+
+    cursor.execute("DELETE FROM UserFactor")
+    cursor.execute("DELETE FROM CityFactor")
+    cursor.executemany("INSERT INTO UserFactor (email, factors) VALUES (?, ?)",
+                       [(email, factors.tobytes()) for email, factors in zip(emails, user_factors)])
+    cursor.executemany("INSERT INTO CityFactor (city, factors) VALUES (?, ?)",
+                       [(city, factors.tobytes()) for city, factors in zip(cities, city_factors)])
+    cursor.execute("""
+    INSERT OR REPLACE INTO FactorModel (id, trained_at, factors, regularization, alpha)
+    VALUES (1, ?, ?, ?, ?)
+    """, (time.time(), user_factors.shape[1],
+          options.get("regularization", CF_REGULARIZATION), options.get("alpha", CF_ALPHA)))
+    conn.commit()
+    return len(votes), len(emails), len(cities)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the collaborative-filtering model from VoteUC")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--db", default="data/reunion.db")
+    parser.add_argument("--factors", type=int, default=CF_FACTORS)
+    parser.add_argument("--regularization", type=float, default=CF_REGULARIZATION)
+    parser.add_argument("--alpha", type=float, default=CF_ALPHA)
+    parser.add_argument("--iterations", type=int, default=CF_ITERATIONS)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    migrations.migrate(conn)  # Factor tables on databases that predate them
+    start = time.perf_counter()
+    result = train_and_store(conn, factors=args.factors, regularization=args.regularization,
+                             alpha=args.alpha, iterations=args.iterations)
+    conn.close()
+    if result is None:
+        print("No votes in VoteUC; nothing to train.")
+    else:
+        print(f"Trained on {result[0]} votes ({result[1]} users x {result[2]} cities) "
+              f"in {time.perf_counter() - start:.2f}s.")
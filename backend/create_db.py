@@ -1,6 +1,8 @@
 import sqlite3
 import os
 
+import migrations
+
 # Create database directory if it doesn't exist
 os.makedirs('data', exist_ok=True)
 
@@ -9,6 +11,17 @@ conn = sqlite3.connect('data/reunion.db')
 cursor = conn.cursor()
 
 # Drop tables if they exist (for easy recreation during development)
+cursor.execute("DROP TABLE IF EXISTS schema_version")
+cursor.execute("DROP TABLE IF EXISTS CatalogVersion")
+cursor.execute("DROP TABLE IF EXISTS FlightVersion")
+cursor.execute("DROP TABLE IF EXISTS FactorModel")
+cursor.execute("DROP TABLE IF EXISTS UserFactor")
+cursor.execute("DROP TABLE IF EXISTS CityFactor")
+cursor.execute("DROP TABLE IF EXISTS VoteQueue")
+cursor.execute("DROP TABLE IF EXISTS UserRecommendation")
+cursor.execute("DROP TABLE IF EXISTS GroupRecommendation")
+cursor.execute("DROP TABLE IF EXISTS GroupCentroid")
+cursor.execute("DROP TABLE IF EXISTS ImageVariant")
 cursor.execute("DROP TABLE IF EXISTS Image")
 cursor.execute("DROP TABLE IF EXISTS VoteUC")
 cursor.execute("DROP TABLE IF EXISTS CityCateg")
@@ -66,6 +79,8 @@ CREATE TABLE Image (
     city_name TEXT NOT NULL, 
     image_data BLOB NOT NULL,         -- Stores binary image data
     content_type TEXT NOT NULL,       -- Stores MIME type (e.g., 'image/jpeg')
+    sha256 TEXT,                      -- Hex digest of the image (HTTP ETag, image store path)
+    storage TEXT NOT NULL DEFAULT 'db', -- 'db': bytes in image_data, 'file': in image_store.py
     "order" INTEGER NOT NULL,           -- Order of the image (1, 2, 3)
     FOREIGN KEY (city_name) REFERENCES City(name) ON DELETE CASCADE,
     UNIQUE(city_name, "order")        -- Ensure only 3 images per city in order
@@ -143,6 +158,11 @@ CREATE TABLE Flight (
 
 print("Database tables created successfully.")
 
-# Commit changes and close connection
+# Commit changes
 conn.commit()
+
+# Derived tables, indexes, triggers and later schema changes live in migrations.py
+applied = migrations.migrate(conn)
+print(f"Applied migrations: {', '.join(applied)}")
+
 conn.close() 
\ No newline at end of file
@@ -0,0 +1,52 @@
+"""
+Async access to the pooled SQLite connections.
+
+sqlite3 calls block, so running them directly in an async handler stalls
+the event loop for every other in-flight request. AsyncDatabase runs plain
+synchronous helpers, called as fn(conn, *args) with a pooled reader
+connection, on a bounded thread pool and awaits the result:
+
+    user = await db.run(get_user, email)
+
+The pool has one thread per reader connection, so a job never waits for a
+connection while holding a thread; requests beyond that queue in the
+executor without blocking the loop. Each job runs in a copy of the caller's
+contextvars context, so per-request state (e.g. query statistics) follows
+the work into the thread.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", 0))  # 0: one per pooled reader
+
+
+class AsyncDatabase:
+    """Runs reader jobs on pooled connections in a bounded thread pool"""
+
+    def __init__(self, pool, workers=DB_EXECUTOR_WORKERS):
+        self.pool = pool
+        self.workers = workers or pool.max_readers
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db-reader")
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Await fn(conn, *args) run on a pooled reader connection"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._get_executor(), context.run, self._call, fn, args)
+
+    def _call(self, fn, args):
+        with self.pool.reader() as conn:
+            return fn(conn, *args)
+
+    def close(self):
+        """Wait for running jobs and stop the threads; they restart on the next run"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,189 @@
+"""
+Pooled, pre-configured SQLite connections.
+
+Opening a connection per request pays for the open itself, for re-reading
+the schema and for a cold page cache, and gives no single place to set
+PRAGMAs. ConnectionPool keeps a bounded set of reader connections and one
+dedicated writer connection, all configured once when they are created:
+
+- journal_mode=WAL so readers never block the writer and vice versa;
+- synchronous=NORMAL, which is durable across application crashes in WAL mode;
+- mmap_size / cache_size to keep hot pages in memory;
+- busy_timeout so a connection waits for a lock instead of failing.
+
+Reader connections are handed out LIFO so the most recently used (warmest)
+connection is reused first. The writer is checked out exclusively, which
+serializes the application's own writers instead of having them spin on
+SQLITE_BUSY. Reader connections are not opened read-only, so the occasional
+incidental write from a read path still works (waiting on busy_timeout).
+Checkout wait times are recorded for the metrics endpoint.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_POOL_READERS = int(os.environ.get("DB_POOL_READERS", 8))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+# Negative values are KiB, as in PRAGMA cache_size
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", -16000))
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout"""
+
+
+class _CheckoutStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited):
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def as_dict(self):
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": 1000 * self.wait_total / self.checkouts if self.checkouts else 0.0,
+            "wait_max_ms": 1000 * self.wait_max,
+        }
+
+
+class ConnectionPool:
+    """Bounded reader connections plus one exclusive writer for a database file"""
+
+    def __init__(self, path, readers=DB_POOL_READERS, timeout=DB_POOL_TIMEOUT, factory=sqlite3.Connection):
+        self.path = path
+        self.max_readers = readers
+        self.timeout = timeout
+        self.factory = factory  # Connection class, e.g. sql_stats.InstrumentedConnection
+        self._idle = []  # Idle reader connections, most recently used last
+        self._open_readers = 0
+        self._readers_available = threading.Condition()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._reader_stats = _CheckoutStats()
+        self._writer_stats = _CheckoutStats()
+
+    def connect(self):
+        """Open a new configured connection (not managed by the pool)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Connections move between request threads, but only one uses it at a time
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                               factory=self.factory)
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Check out a reader connection for the duration of the block"""
+        conn = self._checkout_reader()
+        try:
+            yield conn
+        finally:
+            self._checkin_reader(conn)
+
+    @contextmanager
+    def writer(self):
+        """Check out the writer connection exclusively for the duration of the block"""
+        start = time.perf_counter()
+        if not self._writer_lock.acquire(timeout=self.timeout):
+            self._writer_stats.timeouts += 1
+            raise PoolTimeout("Timed out waiting for the database writer")
+        try:
+            self._writer_stats.record(time.perf_counter() - start)
+            if self._writer is None:
+                self._writer = self.connect()
+            try:
+                yield self._writer
+            finally:
+                if not self._reset(self._writer):
+                    self._writer = None
+        finally:
+            self._writer_lock.release()
+
+    def _checkout_reader(self):
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        with self._readers_available:
+            while not self._idle and self._open_readers >= self.max_readers:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._reader_stats.timeouts += 1
+                    raise PoolTimeout("Timed out waiting for a database connection")
+                self._readers_available.wait(remaining)
+            self._reader_stats.record(time.perf_counter() - start)
+            if self._idle:
+                return self._idle.pop()
+            self._open_readers += 1
+        try:
+            return self.connect()
+        except Exception:
+            with self._readers_available:
+                self._open_readers -= 1
+                self._readers_available.notify()
+            raise
+
+    def _checkin_reader(self, conn):
+        healthy = self._reset(conn)
+        with self._readers_available:
+            if healthy:
+                self._idle.append(conn)
+            else:
+                self._open_readers -= 1
+            self._readers_available.notify()
+
+    def _reset(self, conn):
+        """Roll back anything the borrower left open; False if the connection is unusable"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            return True
+        except sqlite3.Error:
+            conn.close()
+            return False
+
+    def close(self):
+        """Close idle connections and the writer; the pool reopens them on demand"""
+        with self._readers_available:
+            for conn in self._idle:
+                conn.close()
+            self._open_readers -= len(self._idle)
+            self._idle = []
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats(self):
+        with self._readers_available:
+            open_readers = self._open_readers
+            idle = len(self._idle)
+        return {
+            "readers": {
+                "max": self.max_readers,
+                "open": open_readers,
+                "in_use": open_readers - idle,
+                **self._reader_stats.as_dict(),
+            },
+            "writer": {
+                "in_use": self._writer_lock.locked(),
+                **self._writer_stats.as_dict(),
+            },
+        }
@@ -0,0 +1,207 @@
+"""
+Single writer thread for all application writes.
+
+SQLite allows one writer at a time; letting every request write through its
+own connection turns concurrent swipes into "database is locked" errors and
+unpredictable latency. DatabaseWriter owns the pool's writer connection and
+runs write jobs from a queue on one thread:
+
+- a job is a function called as job(conn, *args) inside a transaction; it may
+  read and write but must not commit or roll back;
+- jobs waiting in the queue are group-committed: each runs in its own
+  SAVEPOINT (a failing job is rolled back alone and gets its exception) and
+  the whole batch is made durable with a single COMMIT;
+- callers get the job's return value (or exception) back through a future,
+  either blocking (execute) or awaited from an async handler (run).
+
+A batch that fails to commit fails its jobs, not the thread. If the thread
+stops anyway, the jobs still queued fail and submit() refuses new ones.
+
+Readers keep using the pool's reader connections and WAL snapshots.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+
+# Upper bound on jobs sharing one COMMIT
+DB_WRITER_BATCH_MAX = int(os.environ.get("DB_WRITER_BATCH_MAX", 64))
+# Seconds to wait for more jobs before committing a batch
+DB_WRITER_BATCH_WINDOW = float(os.environ.get("DB_WRITER_BATCH_WINDOW", 0.002))
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseWriter:
+    """Runs write jobs on the pool's writer connection with group commit"""
+
+    def __init__(self, pool, batch_max=DB_WRITER_BATCH_MAX, batch_window=DB_WRITER_BATCH_WINDOW):
+        self.pool = pool
+        self.batch_max = batch_max
+        self.batch_window = batch_window
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()  # Orders submit() against the thread stopping
+        self._latencies = collections.deque(maxlen=10000)  # Submit-to-result seconds
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.batches = 0
+        self.failed_commits = 0
+
+    def start(self):
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Finish the queued jobs and release the writer connection"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, job, *args):
+        """Queue job(conn, *args); returns a concurrent.futures.Future with its result"""
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._thread is None or self._closed:
+                raise RuntimeError("The database writer is not running")
+            # The job runs in the submitter's contextvars context (e.g. query statistics)
+            self._queue.put((job, args, future, time.perf_counter(), contextvars.copy_context()))
+        return future
+
+    def execute(self, job, *args):
+        """Run a job and wait for its committed result"""
+        return self.submit(job, *args).result()
+
+    async def run(self, job, *args):
+        """Run a job and await its committed result"""
+        return await asyncio.wrap_future(self.submit(job, *args))
+
+    def _run(self):
+        batch = []
+        try:
+            with self.pool.writer() as conn:
+                # Transactions and savepoints are issued explicitly below
+                conn.isolation_level = None
+                try:
+                    stopping = False
+                    while not stopping:
+                        item = self._queue.get()
+                        if item is None:
+                            return
+                        batch = [item]
+                        deadline = time.perf_counter() + self.batch_window
+                        while len(batch) < self.batch_max:
+                            try:
+                                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                            except queue.Empty:
+                                break
+                            if item is None:
+                                stopping = True
+                                break
+                            batch.append(item)
+                        try:
+                            self._commit_batch(conn, batch)
+                        except Exception as e:
+                            logger.exception("Database writer failed on a batch of %d write jobs", len(batch))
+                            self._fail(batch, e)
+                finally:
+                    conn.isolation_level = ""
+        finally:
+            # However the thread stops, nothing may wait on a job it will never run
+            with self._lock:
+                self._closed = True
+            stopped = list(batch)
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    stopped.append(item)
+            self._fail(stopped, RuntimeError("The database writer stopped"))
+
+    def _fail(self, batch, error):
+        """Fail every job of batch that has no result yet"""
+        for _, _, future, _, _ in batch:
+            if future.done():
+                continue
+            if future.running() or future.set_running_or_notify_cancel():
+                self.failed_jobs += 1
+                future.set_exception(error)
+
+    def _commit_batch(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, args, future, _, context in batch:
+                if not future.set_running_or_notify_cancel():
+                    # The caller went away before the job started
+                    outcomes.append(None)
+                    continue
+                # The slot is taken before any statement, so a failure below
+                # fails this running job instead of starting it again
+                outcomes.append((False, None))
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = context.run(job, conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    outcomes[-1] = (False, e)
+                else:
+                    conn.execute("RELEASE job")
+                    outcomes[-1] = (True, result)
+            conn.execute("COMMIT")
+        except Exception as e:
+            # Nothing in the batch was committed
+            if conn.in_transaction:
+                conn.rollback()
+            self.failed_commits += 1
+            logger.exception("Failed to commit a batch of %d write jobs", len(batch))
+            outcomes = [None if outcome is None else (False, e) for outcome in outcomes]
+            for _, _, future, _, _ in batch[len(outcomes):]:
+                outcomes.append((False, e) if future.set_running_or_notify_cancel() else None)
+
+        self.batches += 1
+        now = time.perf_counter()
+        for (_, _, future, submitted, _), outcome in zip(batch, outcomes):
+            if outcome is None:
+                continue
+            self.jobs += 1
+            self._latencies.append(now - submitted)
+            ok, value = outcome
+            if ok:
+                future.set_result(value)
+            else:
+                self.failed_jobs += 1
+                future.set_exception(value)
+
+    def stats(self):
+        latencies = sorted(self._latencies.copy())
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return 1000 * latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+        return {
+            "running": self._thread is not None and not self._closed,
+            "queue_depth": self._queue.qsize(),
+            "jobs": self.jobs,
+            "failed_jobs": self.failed_jobs,
+            "batches": self.batches,
+            "failed_commits": self.failed_commits,
+            "avg_batch_size": self.jobs / self.batches if self.batches else 0.0,
+            "latency_p50_ms": percentile(50),
+            "latency_p95_ms": percentile(95),
+            "latency_p99_ms": percentile(99),
+        }
@@ -0,0 +1,135 @@
+"""
+Benchmark the columnar flight index against the SQL flight search.
+
+Builds a synthetic Flight table (or loads the real one with --db) into an
+in-memory SQLite database with the search index of migrations.py, then
+reports the average latency of random searches through both paths.
+
+Usage: python flight_benchmark.py --flights 2000000 --cities 300 --queries 200
+"""
+import argparse
+import datetime
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import flight_index
+
+COMPANIES = ["EuroWings", "SkyEurope", "MediterraneanAir", "NordicFlyers"]
+MODELS = ["A320neo", "A321neo", "Boeing 737-800", "Boeing 787-9", "Embraer E190"]
+
+
+def synthetic_flights(conn, n_flights, n_cities, days, seed):
+    """n_flights between n_cities over days days from 2025-05-10"""
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(2025, 5, 10)
+    conn.execute("""
+    CREATE TABLE Flight (
+        code INTEGER PRIMARY KEY, cost REAL, depCity TEXT, arrCity TEXT, depTime TEXT,
+        timeDuration INTEGER, distance REAL, planeModel TEXT, company TEXT
+    )
+    """)
+    batch = 100000
+    for offset in range(0, n_flights, batch):
+        n = min(batch, n_flights - offset)
+        seconds = rng.integers(0, days * 86400, n)
+        distance = rng.uniform(500, 3000, n)
+        conn.executemany(
+            "INSERT INTO Flight VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            zip(
+                range(offset, offset + n),
+                (distance * 0.1 + rng.uniform(50, 150, n)).tolist(),
+                (f"city_{i:04d}" for i in rng.integers(0, n_cities, n)),
+                (f"city_{i:04d}" for i in rng.integers(0, n_cities, n)),
+                ((start + datetime.timedelta(seconds=int(s))).isoformat() for s in seconds),
+                rng.integers(60, 300, n).tolist(),
+                distance.tolist(),
+                (MODELS[i] for i in rng.integers(0, len(MODELS), n)),
+                (COMPANIES[i] for i in rng.integers(0, len(COMPANIES), n)),
+            )
+        )
+    conn.commit()
+
+
+def random_searches(conn, n_queries, seed):
+    rng = np.random.default_rng(seed + 1)
+    cities = [row[0] for row in conn.execute("SELECT DISTINCT depCity FROM Flight")]
+    first, last = conn.execute("SELECT MIN(depTime), MAX(depTime) FROM Flight").fetchone()
+    first, last = flight_index.to_epoch(first), flight_index.to_epoch(last)
+    epoch = datetime.datetime(1970, 1, 1)
+    searches = []
+    for _ in range(n_queries):
+        begin = int(rng.integers(first, last))
+        end = begin + int(rng.integers(1, 3)) * 86400
+        searches.append(SimpleNamespace(
+            departure_city=cities[rng.integers(len(cities))],
+            min_date=(epoch + datetime.timedelta(seconds=begin)).isoformat(),
+            max_date=(epoch + datetime.timedelta(seconds=end)).isoformat(),
+            max_budget=float(rng.choice([0, 150, 250])) or None,
+            companies=list(rng.choice(COMPANIES, 2, replace=False)) if rng.random() < 0.5 else None,
+        ))
+    return searches
+
+
+def search_sql(conn, search):
+    """The SQL path of app.find_flights (without importing the app)"""
+    query = "SELECT * FROM Flight WHERE depCity = ? AND depTime BETWEEN ? AND ?"
+    params = [search.departure_city, search.min_date, search.max_date]
+    if search.max_budget:
+        query += " AND cost <= ?"
+        params.append(search.max_budget)
+    if search.companies:
+        query += " AND company IN ({})".format(','.join('?' for _ in search.companies))
+        params.extend(search.companies)
+    return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+def run(conn, n_queries, seed):
+    conn.row_factory = sqlite3.Row
+    start = time.perf_counter()
+    index = flight_index.FlightIndex.load(conn)
+    print(f"Flights: {len(index)} from {len(index.partitions)} cities, "
+          f"index built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    searches = random_searches(conn, n_queries, seed)
+    start = time.perf_counter()
+    expected = [search_sql(conn, s) for s in searches]
+    sql_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+    start = time.perf_counter()
+    found = [index.search(s.departure_city, s.min_date, s.max_date, s.max_budget, s.companies) for s in searches]
+    index_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+    same = sum(
+        sorted(r["code"] for r in e) == sorted(r["code"] for r in f) for e, f in zip(expected, found)
+    )
+    results = np.mean([len(f) for f in found])
+    print(f"{'sql':>6}  {sql_ms:.3f} ms/query")
+    print(f"{'index':>6}  {index_ms:.3f} ms/query  ({results:.0f} flights/query, {same}/{n_queries} identical)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Benchmark the flights in this SQLite database instead of synthetic data")
+    parser.add_argument("--flights", type=int, default=1000000)
+    parser.add_argument("--cities", type=int, default=300)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(":memory:")
+    if args.db:
+        source = sqlite3.connect(args.db)
+        source.backup(conn)
+        source.close()
+    else:
+        start = time.perf_counter()
+        synthetic_flights(conn, args.flights, args.cities, args.days, args.seed)
+        print(f"Generated {args.flights} flights in {time.perf_counter() - start:.1f} s")
+    # Same index as migration 2
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_flight_search ON Flight (depCity, depTime, company, cost)")
+    run(conn, args.queries, args.seed)
+    conn.close()
@@ -0,0 +1,233 @@
+"""
+In-memory columnar index of the Flight table used by /flights/search.
+
+Every flight is kept in NumPy arrays, one per column, sorted by departure
+city and then by departure time (as Unix seconds), so the flights leaving a
+city are one contiguous slice. A search binary-searches the date range
+inside that slice, applies the budget and company filters as vectorized
+masks over it and serializes the matching rows straight from the arrays,
+without touching SQLite or building a row object per flight scanned.
+
+Text columns other than depTime are stored as integer codes into a list of
+their distinct values. depTime keeps its original string, which is what the
+API returns; dates are compared as instants, so "2025-05-10" means midnight.
+
+The index is shared by the whole process and reloaded when the Flight table
+changes, detected through the FlightVersion counter its triggers bump (see
+migrations.py).
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# Set to 0 to answer every search with the SQL query instead
+FLIGHT_INDEX = os.environ.get("FLIGHT_INDEX", "1") != "0"
+
+# Epoch of a departure time that does not parse (NaT in NumPy)
+INVALID_EPOCH = np.iinfo(np.int64).min
+
+# Rows fetched at a time while loading
+LOAD_BATCH_SIZE = 50000
+
+COLUMNS = ("code", "cost", "depCity", "arrCity", "depTime", "timeDuration", "distance", "planeModel", "company")
+
+
+def to_epoch(value):
+    """Unix seconds of an ISO 8601 date or date-time; naive values are taken as UTC"""
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp())
+
+
+def _encode(values):
+    """Integer codes of values into the list of their distinct values, in order of appearance"""
+    labels = list(dict.fromkeys(values))
+    codes = {value: i for i, value in enumerate(labels)}
+    return labels, np.fromiter(map(codes.__getitem__, values), dtype=np.int32, count=len(values))
+
+
+def _epochs(dep_times):
+    """Unix seconds of every departure time; INVALID_EPOCH where it does not parse"""
+    try:
+        # Vectorized for the usual naive ISO strings
+        return np.array(dep_times, dtype="datetime64[s]").astype(np.int64)
+    except ValueError:
+        epochs = np.empty(len(dep_times), dtype=np.int64)
+        for i, value in enumerate(dep_times):
+            try:
+                epochs[i] = to_epoch(value)
+            except ValueError:
+                epochs[i] = INVALID_EPOCH
+        return epochs
+
+
+class FlightIndex:
+    """Flight columns sorted by (departure city, departure time)"""
+
+    def __init__(self, code, cost, dep_city, arr_city, dep_time, time_duration, distance, plane_model, company):
+        epoch = _epochs(dep_time)
+        valid = epoch != INVALID_EPOCH
+        self.skipped = int(np.count_nonzero(~valid))
+
+        self.cities, city = _encode(dep_city)
+        self.arr_cities, arr_city = _encode(arr_city)
+        self.plane_models, plane_model = _encode(plane_model)
+        self.companies, company = _encode(company)
+        self.company_index = {name: i for i, name in enumerate(self.companies)}
+
+        city, epoch = city[valid], epoch[valid]
+        code = np.asarray(code, dtype=np.int64)[valid]
+        order = np.lexsort((code, epoch, city))
+
+        self.epoch = epoch[order]
+        self.code = code[order]
+        self.cost = np.asarray(cost, dtype=np.float64)[valid][order]
+        self.dep_time = np.asarray(dep_time, dtype=object)[valid][order]
+        self.time_duration = np.asarray(time_duration, dtype=np.int64)[valid][order]
+        self.distance = np.asarray(distance, dtype=np.float64)[valid][order]
+        self.arr_city = arr_city[valid][order]
+        self.plane_model = plane_model[valid][order]
+        self.company = company[valid][order]
+
+        # depCity -> [start, end) of its flights
+        city = city[order]
+        bounds = np.searchsorted(city, np.arange(len(self.cities) + 1))
+        self.partitions = {
+            name: (int(bounds[i]), int(bounds[i + 1])) for i, name in enumerate(self.cities)
+        }
+
+    def __len__(self):
+        return len(self.code)
+
+    @classmethod
+    def load(cls, conn):
+        """Build the index from the Flight table"""
+        cursor = conn.cursor()
+        cursor.row_factory = None  # Plain tuples, much cheaper than sqlite3.Row for millions of rows
+        # Rows with a NULL cannot be returned as a Flight
+        cursor.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM Flight WHERE "
+            + " AND ".join(f"{column} IS NOT NULL" for column in COLUMNS)
+        )
+        # Transposed batch by batch, so the rows are never all held twice
+        columns = [[] for _ in COLUMNS]
+        while batch := cursor.fetchmany(LOAD_BATCH_SIZE):
+            for column, values in zip(columns, zip(*batch)):
+                column.extend(values)
+        return cls(*columns)
+
+    def search(self, dep_city, min_date, max_date, max_budget=None, companies=None):
+        """Flights from dep_city leaving between min_date and max_date (inclusive), as dicts.
+
+        Raises ValueError if a date is not ISO 8601.
+        """
+        start_epoch, end_epoch = to_epoch(min_date), to_epoch(max_date)
+        bounds = self.partitions.get(dep_city)
+        if bounds is None:
+            return []
+        start, end = bounds
+        epochs = self.epoch[start:end]
+        lo = start + int(np.searchsorted(epochs, start_epoch, side="left"))
+        hi = start + int(np.searchsorted(epochs, end_epoch, side="right"))
+        if lo >= hi:
+            return []
+
+        mask = None
+        if max_budget:
+            mask = self.cost[lo:hi] <= max_budget
+        if companies:
+            codes = [self.company_index[name] for name in companies if name in self.company_index]
+            in_companies = np.isin(self.company[lo:hi], codes)
+            mask = in_companies if mask is None else mask & in_companies
+        rows = np.arange(lo, hi) if mask is None else lo + np.flatnonzero(mask)
+        return self._serialize(dep_city, rows)
+
+    def _serialize(self, dep_city, rows):
+        arr_cities, plane_models, companies = self.arr_cities, self.plane_models, self.companies
+        return [
+            {
+                "code": code,
+                "cost": cost,
+                "depCity": dep_city,
+                "arrCity": arr_cities[arr_city],
+                "depTime": dep_time,
+                "timeDuration": time_duration,
+                "distance": distance,
+                "planeModel": plane_models[plane_model],
+                "company": companies[company],
+            }
+            for code, cost, arr_city, dep_time, time_duration, distance, plane_model, company in zip(
+                self.code[rows].tolist(),
+                self.cost[rows].tolist(),
+                self.arr_city[rows].tolist(),
+                self.dep_time[rows].tolist(),
+                self.time_duration[rows].tolist(),
+                self.distance[rows].tolist(),
+                self.plane_model[rows].tolist(),
+                self.company[rows].tolist(),
+            )
+        ]
+
+
+_index = None
+_signature = None
+_loaded_at = None
+_load_seconds = None
+_lock = threading.Lock()
+
+
+def _flight_signature(conn):
+    """Cheap fingerprint of the Flight table, used to detect changes"""
+    cursor = conn.cursor()
+    try:
+        # Bumped by triggers on Flight (see migrations.py)
+        cursor.execute("SELECT version FROM FlightVersion WHERE id = 1")
+        row = cursor.fetchone()
+        if row is not None:
+            return ("version", row[0])
+    except sqlite3.OperationalError:
+        pass
+    # Database not migrated yet: fall back to the table size
+    cursor.execute("SELECT COUNT(*), MAX(code), TOTAL(cost) FROM Flight")
+    return tuple(cursor.fetchone())
+
+
+def get_flight_index(conn):
+    """Return the shared flight index, rebuilding it if the Flight table changed"""
+    global _index, _signature, _loaded_at, _load_seconds
+    signature = _flight_signature(conn)
+    if _index is not None:
+        # Loading millions of flights takes seconds: while another search
+        # reloads the index, keep answering from the previous one
+        if signature == _signature or not _lock.acquire(blocking=False):
+            return _index
+    else:
+        _lock.acquire()
+    try:
+        if _index is None or signature != _signature:
+            start = time.perf_counter()
+            _index = FlightIndex.load(conn)
+            _signature = signature
+            _loaded_at = time.time()
+            _load_seconds = time.perf_counter() - start
+        return _index
+    finally:
+        _lock.release()
+
+
+def stats():
+    index = _index
+    return {
+        "enabled": FLIGHT_INDEX,
+        "loaded": index is not None,
+        "flights": len(index) if index is not None else 0,
+        "cities": len(index.partitions) if index is not None else 0,
+        "skipped": index.skipped if index is not None else 0,
+        "loaded_at": _loaded_at,
+        "load_seconds": _load_seconds,
+    }
@@ -0,0 +1,74 @@
+"""
+Persisted, incrementally maintained group preference centroids.
+
+For every (group, category) GroupCentroid stores the sum of the members'
+importance values and the member count, so the group's average importance is
+total / members. Joining a group adds the new member's vector and a vote adds
+the change in the voter's vector to each of their groups, so group
+recommendations never have to re-read every member's ImportanceUC rows.
+
+Members without an ImportanceUC row for a category contribute 0, matching how
+group averages have always been computed.
+"""
+import numpy as np
+
+
+def rebuild(conn, group_code):
+    """Recompute one group's centroid from UGroup and ImportanceUC"""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM GroupCentroid WHERE code = ?", (group_code,))
+    cursor.execute("""
+    INSERT INTO GroupCentroid (code, category, total, members)
+    SELECT g.code, c.name,
+           (SELECT TOTAL(i.importance) FROM UGroup u
+            JOIN ImportanceUC i ON i.email = u.email AND i.category = c.name
+            WHERE u.code = g.code),
+           (SELECT COUNT(*) FROM UGroup u WHERE u.code = g.code)
+    FROM GroupTable g, Category c
+    WHERE g.code = ?
+    """, (group_code,))
+
+
+def backfill(conn):
+    """Build centroids for every group that does not have one yet"""
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT code FROM GroupTable
+    WHERE code NOT IN (SELECT code FROM GroupCentroid)
+    """)
+    codes = [row[0] for row in cursor.fetchall()]
+    for code in codes:
+        rebuild(conn, code)
+    return len(codes)
+
+
+def add_member(conn, group_code, categories, vector):
+    """Fold a new member's importance vector into the group centroid"""
+    contribution = np.nan_to_num(vector, nan=0.0)
+    conn.cursor().executemany("""
+    INSERT INTO GroupCentroid (code, category, total, members) VALUES (?, ?, ?, 1)
+    ON CONFLICT(code, category) DO UPDATE
+    SET total = total + excluded.total, members = members + 1
+    """, [(group_code, category, float(value)) for category, value in zip(categories, contribution)])
+
+
+def apply_delta(conn, user_email, categories, old_vector, new_vector):
+    """Propagate a change in one user's importance to all of their groups"""
+    delta = np.nan_to_num(new_vector, nan=0.0) - np.nan_to_num(old_vector, nan=0.0)
+    changed = np.flatnonzero(delta)
+    if len(changed) == 0:
+        return
+    conn.cursor().executemany("""
+    UPDATE GroupCentroid SET total = total + ?
+    WHERE category = ? AND code IN (SELECT code FROM UGroup WHERE email = ?)
+    """, [(float(delta[i]), categories[i], user_email) for i in changed])
+
+
+def get_centroid(conn, group_code):
+    """Average importance per category for a group, or None if it has no centroid or no members"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT category, total, members FROM GroupCentroid WHERE code = ?", (group_code,))
+    rows = cursor.fetchall()
+    if not rows or not rows[0][2]:
+        return None
+    return {row[0]: row[1] / row[2] for row in rows}
@@ -0,0 +1,63 @@
+"""
+Byte-budgeted in-process LRU cache of image payloads.
+
+A few images (those of the top recommendations) get most of the /images
+traffic. The cache keeps their bytes, content type and ETag in memory so a
+hit is answered (including 304 and Range) without a database connection or
+a file read. It is bounded by the total bytes it holds, not by the number of
+entries, and an image larger than IMAGE_CACHE_MAX_ENTRY_BYTES is never
+admitted, so one huge photo cannot flush the hot set. Images are immutable
+per id and variant, so entries never need invalidating.
+"""
+import os
+
+from lru_cache import LRUCache
+
+# Total payload bytes held; 0 disables the cache
+IMAGE_CACHE_BYTES = int(os.environ.get("IMAGE_CACHE_BYTES", 64 * 1024 * 1024))
+# Largest image admitted
+IMAGE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+
+
+class ImageCache(LRUCache):
+    """(image id, size variant) -> (data, content type, ETag), bounded by total bytes"""
+
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES, max_entry_bytes=IMAGE_CACHE_MAX_ENTRY_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.resident_bytes = 0
+        self.rejected = 0
+
+    def admits(self, size):
+        """Whether an image of size bytes would be cached (load it whole only if so)"""
+        if size <= self.max_entry_bytes:
+            return True
+        self.rejected += 1
+        return False
+
+    def put(self, key, data, content_type, etag):
+        if not self.admits(len(data)):
+            return
+        with self._lock:
+            self._store(key, (data, content_type, etag))
+
+    def _added(self, value):
+        self.resident_bytes += len(value[0])
+
+    def _removed(self, value):
+        self.resident_bytes -= len(value[0])
+
+    def _over_budget(self):
+        return self.resident_bytes > self.max_bytes
+
+    def _stats(self):
+        return {
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "max_entry_bytes": self.max_entry_bytes,
+            "rejected": self.rejected,
+        }
+
+
+cache = ImageCache()
@@ -0,0 +1,131 @@
+"""
+Bulk ingestion of city photos into the image store.
+
+Expects one folder per city (matched case-insensitively to City.name) with
+any number of .png/.jpg/.jpeg/.webp files; the files of a city, sorted by
+name, become its images with "order" 1..N. Reading, hashing and writing the
+files to the content-addressed store (image_store.py) is I/O-bound and runs
+on a thread pool; rows are inserted with executemany, one transaction per
+batch.
+
+Re-ingesting is incremental: an image whose content is unchanged keeps its
+row and id, a changed one gets a new row (ids are cached by clients as
+immutable, see app.py), and orders beyond a city's current file count are
+removed.
+
+Usage: python image_ingest.py [--img img] [--db data/reunion.db] [--workers N] [--no-variants]
+"""
+import argparse
+import mimetypes
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import image_store
+import image_variants
+import migrations
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+IMAGE_INGEST_WORKERS = int(os.environ.get("IMAGE_INGEST_WORKERS", 16))
+# Rows per executemany and transaction
+IMAGE_INGEST_BATCH_SIZE = 500
+
+
+def scan(img_folder, city_names):
+    """[(city, order, path)] for every image file of every folder matching a city"""
+    cities_by_name = {name.lower(): name for name in city_names}
+    files = []
+    for folder in sorted(os.listdir(img_folder)):
+        folder_path = os.path.join(img_folder, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        city = cities_by_name.get(folder.strip().lower())
+        if city is None:
+            print(f"Warning: Folder '{folder}' does not match any city in DB. Skipping.")
+            continue
+        names = sorted(
+            name for name in os.listdir(folder_path)
+            if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(folder_path, name))
+        )
+        if not names:
+            print(f"Warning: No valid image file found for city '{city}'. Skipping.")
+        files.extend((city, order, os.path.join(folder_path, name)) for order, name in enumerate(names, start=1))
+    return files
+
+
+def _load(item):
+    """Copy one file to the image store; runs on the thread pool"""
+    city, order, path = item
+    content_type, _ = mimetypes.guess_type(path)
+    with open(path, "rb") as f:
+        digest = image_store.store.put(f.read())
+    return city, content_type or "application/octet-stream", order, digest
+
+
+def _insert_batch(conn, rows):
+    """Insert (city, content_type, order, sha256) rows; returns how many were new or changed"""
+    # A changed image must get a new id, so its old row goes
+    conn.executemany(
+        "DELETE FROM Image WHERE city_name = ? AND \"order\" = ? AND sha256 IS NOT ?",
+        [(city, order, digest) for city, _, order, digest in rows]
+    )
+    cursor = conn.executemany(
+        "INSERT OR IGNORE INTO Image (city_name, image_data, content_type, \"order\", sha256, storage) "
+        "VALUES (?, x'', ?, ?, ?, 'file')",
+        rows
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def ingest(conn, img_folder, workers=IMAGE_INGEST_WORKERS, batch_size=IMAGE_INGEST_BATCH_SIZE):
+    """Ingest every city folder under img_folder; returns counts of files, new images, removed images and cities"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM City")
+    files = scan(img_folder, [row[0] for row in cursor.fetchall()])
+
+    added = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batch = []
+        for row in executor.map(_load, files):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                added += _insert_batch(conn, batch)
+                batch = []
+        if batch:
+            added += _insert_batch(conn, batch)
+
+    # Photos removed from a folder, and variants of replaced images
+    image_counts = {}
+    for city, order, _ in files:
+        image_counts[city] = max(order, image_counts.get(city, 0))
+    cursor = conn.executemany(
+        "DELETE FROM Image WHERE city_name = ? AND \"order\" > ?",
+        list(image_counts.items())
+    )
+    removed = cursor.rowcount
+    conn.execute("DELETE FROM ImageVariant WHERE image_id NOT IN (SELECT id FROM Image)")
+    conn.commit()
+    return {"files": len(files), "added": added, "removed": removed, "cities": len(image_counts)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest city photos into the image store")
+    parser.add_argument("--img", default="img", help="Folder with one subfolder of photos per city")
+    parser.add_argument("--db", default="data/reunion.db")
+    parser.add_argument("--workers", type=int, default=IMAGE_INGEST_WORKERS)
+    parser.add_argument("--no-variants", action="store_true", help="Do not build the resized variants")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    migrations.migrate(conn)  # Image.sha256/storage and ImageVariant
+    start = time.perf_counter()
+    result = ingest(conn, args.img, workers=args.workers)
+    print(f"Ingested {result['files']} files for {result['cities']} cities in {time.perf_counter() - start:.1f} s: "
+          f"{result['added']} new or changed, {result['removed']} removed")
+    if not args.no_variants:
+        start = time.perf_counter()
+        built = image_variants.build_variants(conn)
+        print(f"Built variants for {built} image(s) in {time.perf_counter() - start:.1f} s")
+    conn.close()
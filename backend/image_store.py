@@ -0,0 +1,127 @@
+"""
+Content-addressed on-disk store for image bytes.
+
+Keeping photos as BLOBs in Image bloats reunion.db, pushes hot pages out of
+SQLite's cache and sends every image through Python memory. The store keeps
+each image in a file named by the SHA-256 of its content,
+
+    IMAGE_STORE_DIR/ab/cd/abcd...  (the full hex digest)
+
+and Image keeps only the metadata: sha256, content_type and storage = 'file'
+(image_data is left empty). Rows with storage = 'db' still have their bytes
+in image_data and are served from there. Identical images share one file,
+and files are written to a temporary name and renamed, so a reader never
+sees a partial file.
+
+/images/{id} serves stored files with FileResponse, which hands the path to
+the server (sendfile where the ASGI server supports it) and handles Range.
+
+Usage:
+    python image_store.py status   # images in the database and in the store
+    python image_store.py migrate  # move BLOBs out of the database
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+import migrations
+
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", "data/images")
+# Bytes copied at a time when moving a BLOB out of the database
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class ImageStore:
+    """Image bytes stored by SHA-256 under a root directory"""
+
+    def __init__(self, root=IMAGE_STORE_DIR):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def put(self, data):
+        """Store data (bytes or an iterable of bytes chunks); returns its hex SHA-256"""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = [data]
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in data:
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            path = self.path(digest.hexdigest())
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest.hexdigest()
+
+
+store = ImageStore()
+
+
+def _blob_chunks(conn, image_id):
+    with conn.blobopen("Image", "image_data", image_id, readonly=True) as blob:
+        while chunk := blob.read(COPY_CHUNK_SIZE):
+            yield chunk
+
+
+def migrate_blobs(conn, image_store=store):
+    """Move every image still stored in the database to the store; returns the number moved"""
+    moved = 0
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, sha256 FROM Image WHERE storage = 'db' ORDER BY id")
+    for image_id, expected in cursor.fetchall():
+        # Copied chunk by chunk, so memory use does not depend on the image size
+        digest = image_store.put(_blob_chunks(conn, image_id))
+        if expected is not None and digest != expected:
+            print(f"Warning: image {image_id} content does not match its stored sha256, updating it")
+        conn.execute(
+            "UPDATE Image SET storage = 'file', sha256 = ?, image_data = x'' WHERE id = ? AND storage = 'db'",
+            (digest, image_id)
+        )
+        conn.commit()  # One image at a time: safe to interrupt and re-run
+        moved += 1
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the image store and move BLOBs into it")
+    parser.add_argument("command", choices=["status", "migrate"])
+    parser.add_argument("--db", default="data/reunion.db")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM after migrating to shrink the database file")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    migrations.migrate(conn)  # Adds Image.storage to older databases
+    if args.command == "migrate":
+        moved = migrate_blobs(conn)
+        print(f"Moved {moved} image(s) to {store.root}")
+        if args.vacuum:
+            conn.execute("VACUUM")
+            print("Vacuumed the database")
+    for storage, count, size in conn.execute(
+        "SELECT storage, COUNT(*), SUM(length(image_data)) FROM Image GROUP BY storage"
+    ).fetchall():
+        print(f"{storage:5s} {count:6d} image(s), {size or 0} bytes in the database")
+    missing = [image_id for image_id, digest in conn.execute(
+        "SELECT id, sha256 FROM Image WHERE storage = 'file'"
+    ).fetchall() if not store.exists(digest)]
+    if missing:
+        print(f"Missing from the store: {len(missing)} image(s), e.g. id {missing[0]}")
+    conn.close()
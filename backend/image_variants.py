@@ -0,0 +1,141 @@
+"""
+Precomputed, resized variants of every image.
+
+Cards and group lists show images far smaller than the originals, so each
+image gets WebP variants built once, at ingest time:
+
+    thumbnail  longest side <= 160 px  (group lists)
+    card       longest side <= 640 px  (swipe cards)
+    full       longest side <= 1920 px (detail view)
+
+Variants are never upscaled. They are written to the content-addressed image
+store (image_store.py) next to the originals and listed in ImageVariant.
+/images/{id}?size=card serves one, and falls back to the original while it
+has not been built. Nothing is resized at request time.
+
+Resizing is CPU-bound, so build_variants decodes and encodes on a process
+pool; the parent only reads originals and writes the results. Pillow is an
+optional dependency: without it no variants are built and the originals are
+served.
+
+Usage: python image_variants.py build [--db data/reunion.db] [--workers N] [--rebuild]
+"""
+import argparse
+import collections
+import io
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # Optional: originals are served as they are
+    PILImage = None
+
+import image_store
+import migrations
+
+# Name -> longest side in pixels, smallest first
+VARIANT_SIZES = {"thumbnail": 160, "card": 640, "full": 1920}
+VARIANT_FORMAT = "WEBP"
+VARIANT_CONTENT_TYPE = "image/webp"
+VARIANT_QUALITY = int(os.environ.get("IMAGE_VARIANT_QUALITY", 80))
+IMAGE_VARIANT_WORKERS = int(os.environ.get("IMAGE_VARIANT_WORKERS", os.cpu_count() or 1))
+
+
+def render_variants(source):
+    """Encoded variants of an image (a file path or its bytes): {size: (bytes, width, height)}; runs in a worker process"""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            source = f.read()
+    with PILImage.open(io.BytesIO(source)) as original:
+        original.load()
+        # WebP has no CMYK/palette-with-alpha modes
+        if original.mode not in ("RGB", "RGBA"):
+            has_alpha = original.mode in ("LA", "PA") or "transparency" in original.info
+            original = original.convert("RGBA" if has_alpha else "RGB")
+        variants = {}
+        for size, longest_side in VARIANT_SIZES.items():
+            image = original.copy()
+            image.thumbnail((longest_side, longest_side), PILImage.LANCZOS)  # Keeps the aspect ratio
+            buffer = io.BytesIO()
+            image.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+            variants[size] = (buffer.getvalue(), image.width, image.height)
+        return variants
+
+
+def _original_source(conn, image_id, sha256, storage):
+    """What render_variants needs: the image store path, or the BLOB for images still in the database"""
+    if storage == "file":
+        return image_store.store.path(sha256)
+    cursor = conn.cursor()
+    cursor.execute("SELECT image_data FROM Image WHERE id = ?", (image_id,))
+    return cursor.fetchone()[0]
+
+
+def _store_variants(conn, image_id, variants):
+    for size, (data, width, height) in variants.items():
+        digest = image_store.store.put(data)
+        conn.execute(
+            "INSERT OR REPLACE INTO ImageVariant (image_id, size, sha256, content_type, width, height) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (image_id, size, digest, VARIANT_CONTENT_TYPE, width, height)
+        )
+    conn.commit()
+
+
+def build_variants(conn, image_ids=None, workers=IMAGE_VARIANT_WORKERS, rebuild=False):
+    """Build the missing variants (all of them with rebuild) of the given or all images; returns the count built"""
+    if PILImage is None:
+        print("Pillow is not installed, skipping image variants")
+        return 0
+    cursor = conn.cursor()
+    query = "SELECT id, sha256, storage FROM Image"
+    if not rebuild:
+        query += f" WHERE (SELECT COUNT(*) FROM ImageVariant v WHERE v.image_id = Image.id) < {len(VARIANT_SIZES)}"
+    cursor.execute(query)
+    images = [row for row in cursor.fetchall() if image_ids is None or row[0] in image_ids]
+    if not images:
+        return 0
+
+    built = 0
+    # The calling scripts are single-threaded, so forking is safe and avoids
+    # spawn re-running them in every worker
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = collections.deque()
+
+        def collect():
+            nonlocal built
+            image_id, future = pending.popleft()
+            try:
+                _store_variants(conn, image_id, future.result())
+                built += 1
+            except Exception as e:
+                print(f"Warning: could not build variants of image {image_id}: {e}")
+
+        for image_id, sha256, storage in images:
+            # A few images per worker in flight, so memory does not grow with the catalog
+            if len(pending) >= 2 * workers:
+                collect()
+            source = _original_source(conn, image_id, sha256, storage)
+            pending.append((image_id, executor.submit(render_variants, source)))
+        while pending:
+            collect()
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build resized image variants")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--db", default="data/reunion.db")
+    parser.add_argument("--workers", type=int, default=IMAGE_VARIANT_WORKERS)
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the variants of every image")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    migrations.migrate(conn)  # ImageVariant on databases that predate it
+    built = build_variants(conn, workers=args.workers, rebuild=args.rebuild)
+    print(f"Built variants for {built} image(s)")
+    conn.close()
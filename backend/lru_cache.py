@@ -0,0 +1,102 @@
+"""
+Locked OrderedDict LRU shared by the in-process caches.
+
+LRUCache holds the entries in recency order behind one lock, counts hits,
+misses and evictions and reports them through stats(). Subclasses decide
+what an entry holds and when one is usable (image_cache.py bounds the total
+bytes, user_cache.py expires entries, preference_cache.py checks the
+category order). version() lets a reader that fills a miss from the
+database drop its value if an invalidation happened meanwhile.
+
+Every cache is per process: run a single worker or accept that other
+workers only see a change once their entry is evicted or expires.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU mapping holding at most maxsize entries"""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0  # Bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --- Hooks, called with the lock held ---
+
+    def _added(self, value):
+        pass
+
+    def _removed(self, value):
+        pass
+
+    def _over_budget(self):
+        return len(self._entries) > self.maxsize
+
+    def _stats(self):
+        return {"maxsize": self.maxsize}
+
+    # --- Helpers, called with the lock held ---
+
+    def _lookup(self, key, usable=None):
+        """Value for key, counted as a hit, or None if absent or not usable(value)"""
+        value = self._entries.get(key)
+        if value is None or (usable is not None and not usable(value)):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _store(self, key, value):
+        """Insert or replace key as most recent, then evict down to the budget"""
+        self._discard(key)
+        self._entries[key] = value
+        self._added(value)
+        while self._over_budget():
+            _, evicted = self._entries.popitem(last=False)
+            self._removed(evicted)
+            self.evictions += 1
+
+    def _discard(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._removed(value)
+
+    # --- Public API ---
+
+    def get(self, key):
+        with self._lock:
+            return self._lookup(key)
+
+    def version(self):
+        """Take before reading a value from the database and pass to put"""
+        with self._lock:
+            return self._version
+
+    def invalidate(self, key=None):
+        """Forget one entry, or every entry when key is None"""
+        with self._lock:
+            self._version += 1
+            if key is None:
+                while self._entries:
+                    self._removed(self._entries.popitem()[1])
+            else:
+                self._discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                **self._stats(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
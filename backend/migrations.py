@@ -0,0 +1,332 @@
+"""
+Versioned, idempotent schema migrations.
+
+create_db.py builds a fresh database by dropping every table, which is no
+way to add an index to a database that holds real data. Schema changes are
+instead appended to MIGRATIONS and applied in order at startup (and by
+create_db.py); the schema_version table records which ones already ran.
+
+Rules for migrations:
+
+- never edit or reorder a migration that has shipped, add a new one;
+- every statement must be idempotent (IF NOT EXISTS ...), so a database
+  whose tables were created by create_db.py can still be migrated;
+- a migration spells out its DDL instead of calling into other modules,
+  so changing those modules cannot change a migration that has shipped;
+- each migration runs in its own transaction together with its
+  schema_version row, so a failed migration leaves no trace.
+
+Usage:
+    python migrations.py status  # applied and pending migrations
+    python migrations.py apply   # apply pending migrations
+    python migrations.py check   # EXPLAIN QUERY PLAN for the hot queries
+"""
+import argparse
+import hashlib
+import sqlite3
+import sys
+import time
+
+
+def _derived_tables(conn):
+    """Tables added after the original schema (centroids, queues, caches, factors)"""
+    # Sum of members' importance per category (see group_centroids.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS GroupCentroid (
+        code INTEGER,
+        category TEXT,
+        total REAL NOT NULL DEFAULT 0,      -- Sum of members' importance
+        members INTEGER NOT NULL DEFAULT 0, -- Members included in total
+        PRIMARY KEY (code, category),
+        FOREIGN KEY (code) REFERENCES GroupTable(code) ON DELETE CASCADE,
+        FOREIGN KEY (category) REFERENCES Category(name) ON DELETE CASCADE
+    )
+    """)
+    # Materialized rankings (see recommendation_refresher.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS UserRecommendation (
+        email TEXT,
+        rank INTEGER,
+        city TEXT NOT NULL,
+        score REAL NOT NULL,
+        computed_at REAL NOT NULL, -- Unix time of the refresh
+        PRIMARY KEY (email, rank),
+        FOREIGN KEY (email) REFERENCES User(email) ON DELETE CASCADE,
+        FOREIGN KEY (city) REFERENCES City(name) ON DELETE CASCADE
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS GroupRecommendation (
+        code INTEGER,
+        rank INTEGER,
+        city TEXT NOT NULL,
+        score REAL NOT NULL,
+        computed_at REAL NOT NULL, -- Unix time of the refresh
+        PRIMARY KEY (code, rank),
+        FOREIGN KEY (code) REFERENCES GroupTable(code) ON DELETE CASCADE,
+        FOREIGN KEY (city) REFERENCES City(name) ON DELETE CASCADE
+    )
+    """)
+    # Votes waiting to be applied (see vote_queue.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS VoteQueue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL,
+        city TEXT NOT NULL,
+        value INTEGER NOT NULL CHECK(value IN (0, 1)),
+        enqueued_at REAL NOT NULL, -- Unix time the vote was received
+        FOREIGN KEY (email) REFERENCES User(email) ON DELETE CASCADE,
+        FOREIGN KEY (city) REFERENCES City(name) ON DELETE CASCADE
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_votequeue_email ON VoteQueue (email, id)")
+    # Collaborative-filtering model (see collaborative.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS FactorModel (
+        id INTEGER PRIMARY KEY CHECK(id = 1), -- Single row
+        trained_at REAL NOT NULL,
+        factors INTEGER NOT NULL,
+        regularization REAL NOT NULL,
+        alpha REAL NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS UserFactor (
+        email TEXT PRIMARY KEY,
+        factors BLOB NOT NULL, -- float32 vector
+        FOREIGN KEY (email) REFERENCES User(email) ON DELETE CASCADE
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS CityFactor (
+        city TEXT PRIMARY KEY,
+        factors BLOB NOT NULL, -- float32 vector
+        FOREIGN KEY (city) REFERENCES City(name) ON DELETE CASCADE
+    )
+    """)
+
+
+def _hot_path_indexes(conn):
+    """Secondary indexes for lookups the primary keys do not cover"""
+    # Group members (UGroup's primary key starts with email)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ugroup_code ON UGroup (code, email)")
+    # Flight search: equality on depCity, range on depTime, company/cost filtered in the index
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_flight_search ON Flight (depCity, depTime, company, cost)")
+
+
+def _catalog_version(conn):
+    """Counter bumped by triggers whenever the city catalog changes (see recommender.py)"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS CatalogVersion (
+        id INTEGER PRIMARY KEY CHECK(id = 1), -- Single row
+        version INTEGER NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO CatalogVersion (id, version) VALUES (1, 0)")
+    for table in ("City", "Category", "CityCateg"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_catalog_{table.lower()}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+            END
+            """)
+
+
+def _image_sha256(conn):
+    """Content hash of every image, served as its ETag"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(Image)").fetchall()]
+    if "sha256" not in columns:
+        conn.execute("ALTER TABLE Image ADD COLUMN sha256 TEXT")
+    # Backfill images inserted without one
+    rows = conn.execute("SELECT id, image_data FROM Image WHERE sha256 IS NULL")
+    while True:
+        batch = rows.fetchmany(100)
+        if not batch:
+            break
+        conn.executemany(
+            "UPDATE Image SET sha256 = ? WHERE id = ?",
+            [(hashlib.sha256(image_data).hexdigest(), image_id) for image_id, image_data in batch]
+        )
+
+
+def _image_storage(conn):
+    """Where an image's bytes live: 'db' (image_data) or 'file' (image_store.py)"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(Image)").fetchall()]
+    if "storage" not in columns:
+        conn.execute("ALTER TABLE Image ADD COLUMN storage TEXT NOT NULL DEFAULT 'db'")
+
+
+def _image_variants(conn):
+    """Resized variants of every image (see image_variants.py)"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ImageVariant (
+        image_id INTEGER,
+        size TEXT,                   -- Key of image_variants.VARIANT_SIZES
+        sha256 TEXT NOT NULL,        -- File in the image store
+        content_type TEXT NOT NULL,
+        width INTEGER NOT NULL,
+        height INTEGER NOT NULL,
+        PRIMARY KEY (image_id, size),
+        FOREIGN KEY (image_id) REFERENCES Image(id) ON DELETE CASCADE
+    )
+    """)
+
+
+def _flight_version(conn):
+    """Counter bumped by triggers whenever Flight changes (see flight_index.py)"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS FlightVersion (
+        id INTEGER PRIMARY KEY CHECK(id = 1), -- Single row
+        version INTEGER NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO FlightVersion (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_flight_{event.lower()}
+        AFTER {event} ON Flight
+        BEGIN
+            UPDATE FlightVersion SET version = version + 1 WHERE id = 1;
+        END
+        """)
+
+
+# (version, name, function) in the order they must be applied
+MIGRATIONS = [
+    (1, "derived_tables", _derived_tables),
+    (2, "hot_path_indexes", _hot_path_indexes),
+    (3, "catalog_version", _catalog_version),
+    (4, "image_sha256", _image_sha256),
+    (5, "image_storage", _image_storage),
+    (6, "image_variants", _image_variants),
+    (7, "flight_version", _flight_version),
+]
+
+
+def ensure_version_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at REAL NOT NULL -- Unix time
+    )
+    """)
+    conn.commit()
+
+
+def current_version(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(conn):
+    """Apply every pending migration; returns the names of the ones applied"""
+    ensure_version_table(conn)
+    applied = []
+    for version, name, upgrade in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while we waited for the lock
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            upgrade(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, time.time())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(name)
+    return applied
+
+
+# Hot queries and the index each must use; a plan that scans the table fails
+QUERY_PLANS = [
+    ("SELECT * FROM User WHERE email = ?", ("a",), None),
+    ("SELECT * FROM User WHERE username = ?", ("a",), None),
+    ("SELECT email FROM User WHERE email IN (?, ?)", ("a", "b"), None),
+    ("SELECT category, importance FROM ImportanceUC WHERE email = ?", ("a",), None),
+    ("SELECT email, category, importance FROM ImportanceUC WHERE email IN (?, ?)", ("a", "b"), None),
+    ("SELECT city FROM VoteUC WHERE email = ?", ("a",), None),
+    ("SELECT email, city FROM VoteUC WHERE email IN (?, ?)", ("a", "b"), None),
+    ("SELECT 1 FROM City WHERE name = ?", ("a",), None),
+    ("SELECT content_type, sha256, storage, length(image_data) AS size FROM Image WHERE id = ?", (1,), None),
+    ("SELECT sha256, content_type FROM ImageVariant WHERE image_id = ? AND size = ?", (1, "card"), None),
+    ("SELECT code FROM UGroup WHERE email = ?", ("a",), None),
+    ("SELECT email FROM UGroup WHERE code = ? ORDER BY rowid", (1,), "idx_ugroup_code"),
+    ("SELECT COUNT(*) FROM UGroup WHERE code = ?", (1,), "idx_ugroup_code"),
+    ("SELECT * FROM UGroup WHERE email = ? AND code = ?", ("a", 1), None),
+    ("SELECT mine.code, member.email FROM UGroup mine JOIN UGroup member ON member.code = mine.code "
+     "WHERE mine.email = ? ORDER BY mine.code, member.rowid", ("a",), "idx_ugroup_code"),
+    ("SELECT city, category, value, descr FROM CityCateg WHERE city IN (?, ?) ORDER BY city, category", ("a", "b"), None),
+    ("SELECT city_name, id FROM Image WHERE city_name IN (?, ?) ORDER BY city_name, \"order\"", ("a", "b"), None),
+    ("SELECT * FROM GroupTable WHERE code = ?", (1,), None),
+    ("SELECT category, total, members FROM GroupCentroid WHERE code = ?", (1,), None),
+    ("DELETE FROM GroupCentroid WHERE code = ?", (1,), None),
+    ("UPDATE GroupCentroid SET total = total + ? "
+     "WHERE category = ? AND code IN (SELECT code FROM UGroup WHERE email = ?)", (1.0, "a", "a"), None),
+    ("SELECT 1 FROM VoteQueue WHERE email = ? LIMIT 1", ("a",), "idx_votequeue_email"),
+    ("SELECT DISTINCT email FROM VoteQueue WHERE email IN (?, ?)", ("a", "b"), "idx_votequeue_email"),
+    ("DELETE FROM VoteQueue WHERE email = ? RETURNING id, city, value, enqueued_at", ("a",), "idx_votequeue_email"),
+    ("SELECT city, score, computed_at FROM UserRecommendation WHERE email = ? ORDER BY rank", ("a",), None),
+    ("SELECT city, score, computed_at FROM GroupRecommendation WHERE code = ? ORDER BY rank", (1,), None),
+    ("DELETE FROM UserRecommendation WHERE email = ?", ("a",), None),
+    ("DELETE FROM GroupRecommendation WHERE code = ?", (1,), None),
+    ("SELECT version FROM CatalogVersion WHERE id = 1", (), None),
+    ("SELECT version FROM FlightVersion WHERE id = 1", (), None),
+    ("SELECT * FROM Flight WHERE depCity = ? AND depTime BETWEEN ? AND ?",
+     ("a", "2025", "2026"), "idx_flight_search"),
+    ("SELECT * FROM Flight WHERE depCity = ? AND depTime BETWEEN ? AND ? AND cost <= ? AND company IN (?, ?)",
+     ("a", "2025", "2026", 100, "x", "y"), "idx_flight_search"),
+]
+
+
+def check_query_plans(conn):
+    """EXPLAIN QUERY PLAN every hot query; returns a list of (query, plan, problem)"""
+    problems = []
+    cursor = conn.cursor()
+    for query, params, index in QUERY_PLANS:
+        try:
+            cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        except sqlite3.OperationalError as e:
+            problems.append((query, "", str(e)))
+            continue
+        plan = " | ".join(row[3] for row in cursor.fetchall())
+        if any(step.strip().startswith("SCAN") for step in plan.split("|")):
+            problems.append((query, plan, "full scan"))
+        elif index is not None and index not in plan:
+            problems.append((query, plan, f"does not use {index}"))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply and inspect schema migrations")
+    parser.add_argument("command", choices=["status", "apply", "check"])
+    parser.add_argument("--db", default="data/reunion.db")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ensure_version_table(conn)
+    if args.command == "status":
+        version = current_version(conn)
+        for number, name, _ in MIGRATIONS:
+            print(f"{number:3d} {name:24s} {'applied' if number <= version else 'pending'}")
+    elif args.command == "apply":
+        applied = migrate(conn)
+        print(f"Applied {len(applied)} migration(s): {', '.join(applied) or 'none'}")
+    else:
+        problems = check_query_plans(conn)
+        for query, plan, problem in problems:
+            print(f"FAIL ({problem}): {query}\n    {plan}")
+        print(f"{len(QUERY_PLANS) - len(problems)}/{len(QUERY_PLANS)} query plans OK")
+        conn.close()
+        sys.exit(1 if problems else 0)
+    conn.close()
@@ -0,0 +1,79 @@
+"""
+Benchmark event-loop latency during a burst of concurrent logins.
+
+Runs --logins password verifications at once on an asyncio loop, either
+inline (what an async handler calling pwd_context directly would do) or
+through the passwords.py process pool, while a probe task measures how late
+the loop wakes it up. Every other request on the server waits just as long.
+
+Usage: python password_benchmark.py --logins 200 --rounds 12 --modes inline pool
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import numpy as np
+
+
+async def probe(lags, interval, stop):
+    """Record how far past each interval the loop lets the probe run"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(passwords, mode, n_logins, hashed):
+    async def login():
+        if mode == "inline":
+            return passwords.pwd_context.verify("password123", hashed)
+        valid, _ = await passwords.verify_and_update("password123", hashed)
+        return valid
+
+    lags = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, 0.005, stop))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(n_logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+
+    assert all(results)
+    lags = np.array(lags) * 1000
+    print(f"{mode:>7}  {n_logins} logins in {elapsed:.2f} s ({n_logins / elapsed:.0f}/s)  "
+          f"loop lag p50={np.percentile(lags, 50):.1f} ms  p99={np.percentile(lags, 99):.1f} ms  "
+          f"max={lags.max():.1f} ms")
+
+
+async def main(args):
+    import passwords
+
+    hashed = passwords.pwd_context.hash("password123")
+    print(f"bcrypt rounds={passwords.PASSWORD_HASH_ROUNDS}, workers={passwords.PASSWORD_HASH_WORKERS}")
+    if "pool" in args.modes:
+        # Start the worker processes outside the measurement
+        await asyncio.gather(*(passwords.verify_and_update("password123", hashed)
+                               for _ in range(passwords.PASSWORD_HASH_WORKERS)))
+    for mode in args.modes:
+        await run(passwords, mode, args.logins, hashed)
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, help="bcrypt cost (default: PASSWORD_HASH_ROUNDS)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: PASSWORD_HASH_WORKERS)")
+    parser.add_argument("--modes", nargs="+", choices=["inline", "pool"], default=["inline", "pool"])
+    args = parser.parse_args()
+
+    # passwords.py reads these at import; the worker processes inherit them
+    if args.rounds is not None:
+        os.environ["PASSWORD_HASH_ROUNDS"] = str(args.rounds)
+    if args.workers is not None:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    asyncio.run(main(args))
@@ -0,0 +1,79 @@
+"""
+Password hashing off the event loop.
+
+Passwords are hashed with bcrypt through pwd_context. A bcrypt hash costs
+~100 ms+ of CPU by design, and in an async handler that would stall every
+other request for as long, so hashing and verification run on a bounded
+process pool (processes, because bcrypt holds the GIL for part of the work
+and the point is to keep CPU away from the server process):
+
+    hashed = await passwords.hash_password(password)
+    valid, new_hash = await passwords.verify_and_update(password, hashed)
+
+Accounts created before bcrypt have unsalted hex SHA-256 hashes. pwd_context
+still accepts them but marks them deprecated, so verify_and_update returns a
+bcrypt replacement (new_hash) on the first successful login; the same happens
+when PASSWORD_HASH_ROUNDS is raised. The caller stores it.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+# bcrypt cost factor: every +1 doubles the time per hash
+PASSWORD_HASH_ROUNDS = int(os.environ.get("PASSWORD_HASH_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt", "hex_sha256"],  # hex_sha256: legacy hashes, verified and replaced
+    deprecated="auto",
+    bcrypt__rounds=PASSWORD_HASH_ROUNDS,
+)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: forking a process that runs DB threads is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+# Run in the worker processes (module-level so they can be pickled)
+def _hash(password):
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password, hashed):
+    try:
+        return pwd_context.verify_and_update(password, hashed)
+    except ValueError:
+        # Not a hash pwd_context knows (e.g. an empty or corrupt password column)
+        return False, None
+
+
+async def hash_password(password):
+    """bcrypt hash of password, computed in the process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _hash, password)
+
+
+async def verify_and_update(password, hashed):
+    """(valid, new_hash); new_hash is a replacement to store when hashed is outdated"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _verify_and_update, password, hashed)
+
+
+def shutdown():
+    """Stop the worker processes; the pool restarts on the next call"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,49 @@
+"""
+Bounded in-process LRU cache of user importance vectors.
+
+Each entry is a float64 NumPy vector in the city matrix category order, with
+NaN for categories the user has no ImportanceUC row for. The cache is
+write-through: update_user_importance_batch writes the new vector to SQLite
+and replaces the cached one, so the swipe -> recommend loop never has to
+re-read ImportanceUC. A reader filling a miss from its snapshot cannot
+overwrite a newer write-through vector, see version().
+"""
+import os
+
+from lru_cache import LRUCache
+
+PREFERENCE_CACHE_SIZE = int(os.environ.get("PREFERENCE_CACHE_SIZE", 10000))
+
+
+def _built_for(entry, categories):
+    """Whether a cached (categories, vector) entry is in this category order"""
+    return entry is not None and (entry[0] is categories or entry[0] == categories)
+
+
+class PreferenceCache(LRUCache):
+    """email -> (categories, importance vector)"""
+
+    def __init__(self, maxsize=PREFERENCE_CACHE_SIZE):
+        super().__init__(maxsize)
+
+    def get(self, email, categories):
+        """Cached vector for email, or None if absent or built for other categories"""
+        with self._lock:
+            entry = self._lookup(email, lambda entry: _built_for(entry, categories))
+            return entry[1] if entry is not None else None
+
+    def put(self, email, categories, vector, version=None):
+        """Cache a vector: written through (version None), or read on a miss.
+
+        A vector read on a miss is dropped if a write-through or invalidation
+        happened since version() was taken, or if the entry was filled since.
+        """
+        with self._lock:
+            if version is None:
+                self._version += 1
+            elif version != self._version or _built_for(self._entries.get(email), categories):
+                return
+            self._store(email, (categories, vector))
+
+
+cache = PreferenceCache()
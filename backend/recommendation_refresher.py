@@ -0,0 +1,240 @@
+"""
+Materialized recommendation tables kept fresh by background workers.
+
+UserRecommendation and GroupRecommendation hold the top RECOMMENDATION_DEPTH
+ranked cities (name and score) per user / group. Votes and joins mark a user
+or group dirty; a small pool of worker threads (started from the FastAPI
+lifespan) recomputes dirty entries and rewrites their rows. The endpoints
+serve the materialized rows when they are fresh enough and fall back to
+computing synchronously otherwise:
+
+- rows older than RECOMMENDATION_TTL seconds are never served;
+- a dirty user is computed synchronously, so their own votes show up in
+  their next read;
+- a group that has been dirty for more than RECOMMENDATION_MAX_STALENESS
+  seconds is computed synchronously instead of served from its old rows.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+RECOMMENDATION_DEPTH = int(os.environ.get("RECOMMENDATION_DEPTH", 60))
+RECOMMENDATION_WORKERS = int(os.environ.get("RECOMMENDATION_WORKERS", 2))
+RECOMMENDATION_MAX_STALENESS = float(os.environ.get("RECOMMENDATION_MAX_STALENESS", 5))
+RECOMMENDATION_TTL = float(os.environ.get("RECOMMENDATION_TTL", 3600))
+
+logger = logging.getLogger(__name__)
+
+
+# (table, key column) per kind of materialized entry
+_TABLES = {
+    "user": ("UserRecommendation", "email"),
+    "group": ("GroupRecommendation", "code"),
+}
+
+
+class RecommendationRefresher:
+    """Dirty tracking, refresh workers and reads for the materialized tables.
+
+    `connect` opens a database connection for a worker; `rank_user` and
+    `rank_group` are called as rank(conn, key, limit) and must return a list
+    of (city, score) pairs in rank order.
+
+    `execute`, if given, runs the row rewrites: execute(job, *args) must call
+    job(write_conn, *args) inside a transaction, commit it and return the
+    job's result. Without it the workers commit on their own connections.
+    """
+
+    def __init__(self, connect, rank_user, rank_group, workers=RECOMMENDATION_WORKERS, execute=None):
+        self.connect = connect
+        self.rankers = {"user": rank_user, "group": rank_group}
+        self.execute = execute
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._dirty = {}  # (kind, key) -> [dirty since, generation]
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self.refreshed = 0
+        self.served = 0
+        self.fallbacks = 0
+        self.errors = 0
+
+    # --- Dirty tracking ---
+
+    def mark_user_dirty(self, email):
+        self._mark(("user", email))
+
+    def mark_group_dirty(self, group_code):
+        self._mark(("group", group_code))
+
+    def _mark(self, entry):
+        with self._lock:
+            self._generation += 1
+            if entry in self._dirty:
+                self._dirty[entry][1] = self._generation
+            else:
+                self._dirty[entry] = [time.time(), self._generation]
+            if entry in self._pending:
+                return
+            self._pending.add(entry)
+        self._queue.put(entry)
+
+    def _request_refresh(self, entry):
+        """Queue an entry that has no usable rows without marking it dirty"""
+        with self._lock:
+            if entry in self._pending:
+                return
+            self._pending.add(entry)
+        self._queue.put(entry)
+
+    # --- Workers ---
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"recommendation-refresh-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                with self._lock:
+                    self._pending.discard(entry)
+                    generation = self._dirty.get(entry, [None, None])[1]
+                try:
+                    self.refresh(conn, entry, generation)
+                except Exception:
+                    conn.rollback()
+                    self.errors += 1
+                    logger.exception("Failed to refresh recommendations for %s", entry)
+        finally:
+            conn.close()
+
+    def refresh(self, conn, entry, generation=None):
+        """Recompute one user's or group's ranking and rewrite its rows.
+
+        `generation` is the entry's dirty generation when it was dequeued. If the
+        entry was marked dirty again while computing, a newer refresh is already
+        queued and this older ranking must not overwrite its rows.
+        """
+        kind, key = entry
+        ranking = self.rankers[kind](conn, key, RECOMMENDATION_DEPTH)
+        computed_at = time.time()
+        if self.execute is not None:
+            stored = self.execute(self._store, entry, generation, ranking, computed_at)
+        else:
+            try:
+                stored = self._store(conn, entry, generation, ranking, computed_at)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        if not stored:
+            return
+        # Only clean once the rows are committed, so a read never sees the
+        # entry clean with its old rows; a newer mark keeps it dirty
+        with self._lock:
+            if self._dirty.get(entry, [None, None])[1] == generation:
+                self._dirty.pop(entry, None)
+        self.refreshed += 1
+
+    def _store(self, conn, entry, generation, ranking, computed_at):
+        """Rewrite an entry's rows unless superseded, in the caller's transaction; returns whether it did"""
+        kind, key = entry
+        table, column = _TABLES[kind]
+        # Checked inside the write transaction, so a newer refresh's rows are
+        # never overwritten by this older ranking
+        with self._lock:
+            if self._dirty.get(entry, [None, None])[1] != generation:
+                return False
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+        cursor.executemany(
+            f"INSERT INTO {table} ({column}, rank, city, score, computed_at) VALUES (?, ?, ?, ?, ?)",
+            [(key, rank, city, score, computed_at) for rank, (city, score) in enumerate(ranking, start=1)]
+        )
+        return True
+
+    # --- Reads ---
+
+    def read_user(self, conn, email, limit, after=None):
+        """Materialized (city, score) pairs for a user, or None to compute synchronously"""
+        # Read-your-writes: rows predating the user's applied votes are never served
+        return self._read(conn, ("user", email), limit, after, max_staleness=0)
+
+    def read_group(self, conn, group_code, limit, after=None):
+        """Materialized (city, score) pairs for a group, or None to compute synchronously"""
+        return self._read(conn, ("group", group_code), limit, after)
+
+    def _read(self, conn, entry, limit, after, max_staleness=RECOMMENDATION_MAX_STALENESS):
+        kind, key = entry
+        table, column = _TABLES[kind]
+        now = time.time()
+        with self._lock:
+            dirty = self._dirty.get(entry)
+        if dirty is not None and now - dirty[0] >= max_staleness:
+            return self._fallback(entry)
+
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT city, score, computed_at FROM {table} WHERE {column} = ? ORDER BY rank", (key,))
+        rows = cursor.fetchall()
+        if not rows or now - rows[0][2] > RECOMMENDATION_TTL:
+            return self._fallback(entry)
+
+        # Votes cast since the refresh must still be excluded
+        excluded = set()
+        if kind == "user":
+            cursor.execute("SELECT city FROM VoteUC WHERE email = ?", (key,))
+            excluded = {row[0] for row in cursor.fetchall()}
+
+        ranking = []
+        for city, score, _ in rows:
+            if city in excluded:
+                continue
+            if after is not None and (score > after[0] or (score == after[0] and city <= after[1])):
+                continue
+            ranking.append((city, score))
+            if len(ranking) == limit:
+                break
+
+        # A short page is only complete if the materialized ranking was not truncated
+        if len(ranking) < limit and len(rows) >= RECOMMENDATION_DEPTH:
+            return self._fallback(entry)
+
+        self.served += 1
+        return ranking
+
+    def _fallback(self, entry):
+        self.fallbacks += 1
+        self._request_refresh(entry)
+        return None
+
+    def stats(self):
+        with self._lock:
+            dirty = len(self._dirty)
+            oldest = min((since for since, _ in self._dirty.values()), default=None)
+        return {
+            "workers": len(self._threads),
+            "queue_depth": self._queue.qsize(),
+            "dirty": dirty,
+            "oldest_dirty_seconds": time.time() - oldest if oldest is not None else 0.0,
+            "refreshed": self.refreshed,
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+        }
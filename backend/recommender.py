@@ -0,0 +1,291 @@
+"""
+In-memory city x category scoring engine used by the recommendation endpoints.
+
+The whole catalog (every City row against every Category, in a fixed category
+order) is kept as a dense float32 matrix whose rows are pre-normalized, so that
+cosine similarity against every city is a single matrix-vector product.
+"""
+import base64
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+import ann_index
+
+# Value used for a category a city (or user) has no row for
+DEFAULT_VALUE = 5
+
+# How much a single vote moves a user's importance towards/away from a city
+LEARNING_RATE = 0.1
+
+# Approximate search is only worth it on large catalogs; below this size every
+# request does an exact scan. ANN_NPROBE is the default recall/latency knob.
+ANN_INDEX = os.environ.get("RECOMMENDER_ANN_INDEX", "ivf")
+ANN_MIN_CITIES = int(os.environ.get("RECOMMENDER_ANN_MIN_CITIES", 5000))
+ANN_NPROBE = int(os.environ.get("RECOMMENDER_ANN_NPROBE", 16))
+
+# Ranking engine: "content" (cosine of importance vs city values), "cf"
+# (collaborative filtering on votes) or "blend" of both with CF_WEIGHT
+ENGINE = os.environ.get("RECOMMENDER_ENGINE", "content")
+CF_WEIGHT = float(os.environ.get("RECOMMENDER_CF_WEIGHT", 0.3))
+
+
+class CityMatrix:
+    """Dense city x category matrix with L2-normalized rows"""
+
+    def __init__(self, categories, cities, values, present=None):
+        self.categories = list(categories)
+        self.cities = list(cities)
+        self.category_index = {name: i for i, name in enumerate(self.categories)}
+        self.city_index = {name: i for i, name in enumerate(self.cities)}
+        self.values = np.asarray(values, dtype=np.float32).reshape(len(self.cities), len(self.categories))
+        # Which (city, category) cells come from an actual CityCateg row
+        if present is None:
+            present = np.ones(self.values.shape, dtype=bool)
+        self.present = np.asarray(present, dtype=bool)
+
+        # Normalize once so scoring is a plain dot product; all-zero rows stay zero
+        norms = np.linalg.norm(self.values, axis=1, keepdims=True)
+        self.normalized = np.divide(self.values, norms, out=np.zeros_like(self.values), where=norms > 0)
+
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self):
+        """ANN index over the normalized rows, built on first use.
+
+        The index lives on the matrix, so it is rebuilt whenever the matrix is
+        reloaded after a catalog change.
+        """
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = ann_index.build_index(self.normalized, ANN_INDEX)
+        return self._index
+
+    @classmethod
+    def load(cls, conn):
+        """Build the matrix from the Category, City and CityCateg tables"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM Category ORDER BY name")
+        categories = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT name FROM City ORDER BY name")
+        cities = [row[0] for row in cursor.fetchall()]
+
+        category_index = {name: i for i, name in enumerate(categories)}
+        city_index = {name: i for i, name in enumerate(cities)}
+        values = np.full((len(cities), len(categories)), DEFAULT_VALUE, dtype=np.float32)
+        present = np.zeros(values.shape, dtype=bool)
+        cursor.execute("SELECT city, category, value FROM CityCateg")
+        for city, category, value in cursor.fetchall():
+            if city in city_index and category in category_index:
+                values[city_index[city], category_index[category]] = value
+                present[city_index[city], category_index[category]] = True
+
+        return cls(categories, cities, values, present)
+
+    def vector(self, importance, default=DEFAULT_VALUE):
+        """Turn a {category: importance} dict into a vector in matrix category order"""
+        vector = np.full(len(self.categories), default, dtype=np.float32)
+        for category, value in importance.items():
+            i = self.category_index.get(category)
+            if i is not None:
+                vector[i] = value
+        return vector
+
+    def mask(self, city_names):
+        """Boolean mask over the matrix rows that is True for the given cities"""
+        mask = np.zeros(len(self.cities), dtype=bool)
+        indices = [self.city_index[name] for name in city_names if name in self.city_index]
+        mask[indices] = True
+        return mask
+
+    def score(self, vector):
+        """Cosine similarity of a preference vector against every city"""
+        return self.normalized @ unit_vector(vector)
+
+    def rank(self, vector, exclude=None, limit=10, after=None, nprobe=None):
+        """Return up to `limit` (city, score) pairs sorted by descending similarity.
+
+        `after` is a (score, city) key from a previous page; only cities ranked
+        strictly below it are considered, so deeper pages never re-sort or
+        re-return earlier results.
+
+        `nprobe` selects approximate search through the ANN index (higher is
+        more accurate and slower); 0 forces an exact scan and None uses the
+        default for the catalog size.
+        """
+        if nprobe is None:
+            nprobe = ANN_NPROBE if len(self.cities) >= ANN_MIN_CITIES else 0
+
+        keep = np.ones(len(self.cities), dtype=bool)
+        if exclude is not None:
+            keep &= ~exclude
+
+        if nprobe <= 0:
+            return self.rank_by_scores(self.score(vector), exclude, limit, after)
+
+        query = unit_vector(vector)
+        scores = np.zeros(len(self.cities), dtype=np.float32)
+        while True:
+            candidates = self.index.candidates(query, nprobe)
+            scores[candidates] = self.normalized[candidates] @ query
+            results = self._top(scores, candidates, keep, limit, after)
+            # Probe more partitions if filtering left too few candidates
+            if len(results) >= limit or nprobe >= self.index.n_lists:
+                return results
+            nprobe *= 2
+
+    def rank_by_scores(self, scores, exclude=None, limit=10, after=None):
+        """Like rank, but for precomputed scores (one per city)"""
+        keep = np.ones(len(self.cities), dtype=bool)
+        if exclude is not None:
+            keep &= ~exclude
+        return self._top(scores, np.arange(len(self.cities)), keep, limit, after)
+
+    def _top(self, scores, candidates, keep, limit, after):
+        keep = keep[candidates]
+        if after is not None:
+            after_score, after_city = after
+            after_index = self.city_index.get(after_city, -1)
+            candidate_scores = scores[candidates]
+            keep &= (candidate_scores < after_score) | ((candidate_scores == after_score) & (candidates > after_index))
+        order = top_k(scores, candidates[keep], limit)
+        return [(self.cities[i], float(scores[i])) for i in order]
+
+    def rank_many(self, vectors, exclude=None, limit=10):
+        """Rank cities for many preference vectors at once.
+
+        `vectors` is a (users x categories) array and `exclude` an optional
+        (users x cities) boolean mask. Scoring is a single matrix-matrix
+        product; returns one list of (city, score) pairs per row.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+        scores = unit @ self.normalized.T
+
+        candidates = np.arange(len(self.cities))
+        results = []
+        for row in range(len(vectors)):
+            row_candidates = candidates if exclude is None else candidates[~exclude[row]]
+            order = top_k(scores[row], row_candidates, limit)
+            results.append([(self.cities[i], float(scores[row, i])) for i in order])
+        return results
+
+
+def apply_vote(importance, city_values, present, vote_value, learning_rate=LEARNING_RATE):
+    """Importance vector after one like (1) or dislike (0) of a city.
+
+    Only categories the city actually has (`present`) move: towards the city's
+    value on a like, away from it on a dislike, clamped to [1, 10]. Missing
+    (NaN) importances start from DEFAULT_VALUE.
+    """
+    current = np.where(np.isnan(importance), DEFAULT_VALUE, importance)
+    step = learning_rate * (city_values - current)
+    updated = current + step if vote_value == 1 else current - step
+    return np.where(present, np.clip(updated, 1, 10), importance)
+
+
+def apply_votes(importance, city_values, present, vote_values, learning_rate=LEARNING_RATE):
+    """Fold a sequence of votes into an importance vector, in order.
+
+    `city_values` and `present` hold one row per vote; each step is the same
+    vectorized update as apply_vote.
+    """
+    for values, mask, vote_value in zip(city_values, present, vote_values):
+        importance = apply_vote(importance, values, mask, vote_value, learning_rate)
+    return importance
+
+
+def blend(content_scores, cf_scores, cf_weight=CF_WEIGHT):
+    """Weighted mix of standardized content and CF scores.
+
+    Cities the CF model does not know (NaN) get the average CF score.
+    """
+    def standardize(scores):
+        std = np.nanstd(scores)
+        centered = scores - np.nanmean(scores)
+        return np.nan_to_num(centered / std if std > 0 else centered, nan=0.0)
+    return ((1 - cf_weight) * standardize(content_scores) + cf_weight * standardize(cf_scores)).astype(np.float32)
+
+
+def unit_vector(vector):
+    """L2-normalized float32 copy of vector (all zeros stays all zeros)"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def top_k(scores, candidates, k):
+    """Indices of the k best-scoring candidates, ordered by (-score, index).
+
+    Uses a partial selection so the cost is O(n + k log k) rather than a full
+    sort of every candidate.
+    """
+    if k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    if k < len(candidates):
+        partition = np.argpartition(-scores[candidates], k - 1)[:k]
+        # Keep every candidate tied with the k-th score so tie order stays stable
+        threshold = scores[candidates[partition]].min()
+        candidates = candidates[scores[candidates] >= threshold]
+    order = np.lexsort((candidates, -scores[candidates]))[:k]
+    return candidates[order]
+
+
+def encode_cursor(city, score):
+    """Opaque pagination token pointing just after (city, score)"""
+    payload = json.dumps({"c": city, "s": score}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; returns a (score, city) key or raises ValueError"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(payload["s"]), str(payload["c"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+_matrix = None
+_signature = None
+_lock = threading.Lock()
+
+
+def _catalog_signature(conn):
+    """Cheap fingerprint of the catalog tables, used to detect changes"""
+    cursor = conn.cursor()
+    try:
+        # Bumped by triggers on City, Category and CityCateg (see migrations.py)
+        cursor.execute("SELECT version FROM CatalogVersion WHERE id = 1")
+        row = cursor.fetchone()
+        if row is not None:
+            return ("version", row[0])
+    except sqlite3.OperationalError:
+        pass
+    # Database not migrated yet: fall back to scanning the catalog
+    cursor.execute("""
+    SELECT (SELECT COUNT(*) FROM City), (SELECT COUNT(*) FROM Category),
+           COUNT(*), TOTAL(value) FROM CityCateg
+    """)
+    return tuple(cursor.fetchone())
+
+
+def get_city_matrix(conn):
+    """Return the shared city matrix, rebuilding it if the catalog changed"""
+    global _matrix, _signature
+    signature = _catalog_signature(conn)
+    if _matrix is not None and signature == _signature:
+        return _matrix
+    with _lock:
+        if _matrix is None or signature != _signature:
+            _matrix = CityMatrix.load(conn)
+            _signature = signature
+        return _matrix
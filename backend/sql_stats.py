@@ -0,0 +1,202 @@
+"""
+Per-request SQL statistics and a slow-query log.
+
+When SQL_STATS=1 the connection pool creates InstrumentedConnection objects
+whose cursors time every execute/executemany and the fetches that follow it.
+The time is added to the RequestStats of the current request (a contextvar
+set by the app's middleware, which also follows work into the DB threads),
+and the app reports it in a Server-Timing header:
+
+    Server-Timing: db;dur=12.3;desc="14 statements", db-slowest;dur=4.1
+
+Any statement that takes longer than SQL_SLOW_QUERY_MS is written to the
+"slow_queries" logger together with its EXPLAIN QUERY PLAN (and appended to
+SQL_SLOW_QUERY_LOG if that is set).
+
+With SQL_STATS unset the pool uses plain sqlite3 connections and the
+middleware is not installed, so there is no per-statement cost at all.
+"""
+import contextvars
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+SQL_STATS_ENABLED = os.environ.get("SQL_STATS", "0") == "1"
+SQL_SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_QUERY_MS", 100))
+# Optional file the slow-query log is appended to
+SQL_SLOW_QUERY_LOG = os.environ.get("SQL_SLOW_QUERY_LOG")
+
+logger = logging.getLogger("slow_queries")
+if SQL_SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SQL_SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.WARNING)
+
+
+class RequestStats:
+    """Statement count, total time and slowest statement of one request"""
+
+    def __init__(self, label=None):
+        self.label = label
+        self.statements = 0
+        self.seconds = 0.0
+        self.slowest_sql = None
+        self.slowest_seconds = 0.0
+
+    def server_timing(self):
+        return (f'db;dur={1000 * self.seconds:.1f};desc="{self.statements} statements", '
+                f'db-slowest;dur={1000 * self.slowest_seconds:.1f}')
+
+
+_current = contextvars.ContextVar("sql_request_stats", default=None)
+
+
+@contextmanager
+def track(label=None):
+    """Collect the statistics of the statements run inside the block"""
+    stats = RequestStats(label)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each statement, including fetching its rows"""
+
+    _sql = None
+    _parameters = None
+    _elapsed = 0.0
+    _logged = True
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._begin(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._begin(sql, seq_of_parameters[0] if seq_of_parameters else (), time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = None
+        try:
+            row = super().fetchone()
+            return row
+        finally:
+            self._add(time.perf_counter() - start, done=row is None)
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = []
+        try:
+            rows = super().fetchmany(size)
+            return rows
+        finally:
+            self._add(time.perf_counter() - start, done=len(rows) < size)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._add(time.perf_counter() - start, done=True)
+
+    def __next__(self):
+        start = time.perf_counter()
+        exhausted = False
+        try:
+            return super().__next__()
+        except StopIteration:
+            exhausted = True
+            raise
+        finally:
+            self._add(time.perf_counter() - start, done=exhausted)
+
+    def close(self):
+        # Rows never fetched to the end: the statement is over anyway
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _begin(self, sql, parameters, seconds):
+        # The previous statement may have been read with fetchone and never exhausted
+        self._finish()
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = 0.0
+        self._logged = False
+        stats = _current.get()
+        if stats is not None:
+            stats.statements += 1
+        # Statements without a result set are complete once executed
+        self._add(seconds, done=self.description is None)
+
+    def _add(self, seconds, done):
+        self._elapsed += seconds
+        stats = _current.get()
+        if stats is not None:
+            stats.seconds += seconds
+            if self._elapsed > stats.slowest_seconds:
+                stats.slowest_seconds = self._elapsed
+                stats.slowest_sql = self._sql
+        if done:
+            self._finish()
+
+    def _finish(self):
+        """Log the current statement if it was slow, once"""
+        if not self._logged and 1000 * self._elapsed >= SQL_SLOW_QUERY_MS:
+            self._logged = True
+            self._log_slow()
+
+    def _log_slow(self):
+        try:
+            # Plain Connection.execute: not instrumented, leaves this cursor alone
+            rows = sqlite3.Connection.execute(self.connection, "EXPLAIN QUERY PLAN " + self._sql, self._parameters)
+            plan = " | ".join(row[3] for row in rows.fetchall()) or "(no plan)"
+        except sqlite3.Error:
+            plan = "(no plan)"
+        stats = _current.get()
+        logger.warning(
+            "slow query %.1f ms%s: %s\n    plan: %s",
+            1000 * self._elapsed,
+            f" in {stats.label}" if stats is not None and stats.label else "",
+            " ".join(self._sql.split()),
+            plan,
+        )
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including conn.execute shortcuts) are instrumented"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    """Connection class for sqlite3.connect(factory=...)"""
+    return InstrumentedConnection if SQL_STATS_ENABLED else sqlite3.Connection
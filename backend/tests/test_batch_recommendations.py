@@ -0,0 +1,63 @@
+"""
+/admin/recommendations/batch with as many emails as the request model allows.
+
+The connections are limited to 999 bound parameters, the default of SQLite
+before 3.32, so any IN (...) list over all the emails would fail.
+"""
+import os
+import runpy
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as appmod
+
+CREATE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "create_db.py")
+OLD_VARIABLE_LIMIT = 999
+USERS = ["a@example.com", "b@example.com"]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runpy.run_path(CREATE_DB, run_name="create_db")
+    conn = sqlite3.connect(tmp_path / "data" / "reunion.db")
+    conn.executemany("INSERT INTO User (email, username, password) VALUES (?, ?, 'x')",
+                     [(email, email.split("@")[0]) for email in USERS])
+    conn.executemany("INSERT INTO City (name) VALUES (?)", [("Porto",), ("Oslo",)])
+    conn.executemany("INSERT INTO Category (name) VALUES (?)", [("Beach",), ("Nature",)])
+    conn.executemany("INSERT INTO CityCateg (city, category, descr, value) VALUES (?, ?, '', ?)",
+                     [("Porto", "Beach", 8), ("Porto", "Nature", 4), ("Oslo", "Beach", 2), ("Oslo", "Nature", 9)])
+    conn.commit()
+    conn.close()
+
+    connect = appmod.pool.connect
+
+    def limited_connect():
+        conn = connect()
+        conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, OLD_VARIABLE_LIMIT)
+        return conn
+
+    monkeypatch.setattr(appmod.pool, "connect", limited_connect)
+    appmod.app.dependency_overrides[appmod.get_current_admin] = lambda: {"email": USERS[0]}
+    try:
+        with TestClient(appmod.app) as client:
+            yield client
+    finally:
+        appmod.app.dependency_overrides.clear()
+
+
+def test_batch_accepts_max_length_emails(client):
+    max_length = next(m.max_length for m in appmod.BatchRecommendationRequest.model_fields["emails"].metadata
+                      if getattr(m, "max_length", None) is not None)
+    assert max_length > OLD_VARIABLE_LIMIT
+    unknown = [f"nobody{i}@example.com" for i in range(max_length - len(USERS))]
+
+    response = client.post("/admin/recommendations/batch", json={"emails": USERS + unknown, "limit": 2})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert sorted(body["recommendations"]) == USERS
+    assert all(len(cities) == 2 for cities in body["recommendations"].values())
+    assert body["missing"] == unknown
@@ -0,0 +1,88 @@
+"""
+The writer thread must survive failing jobs and never leave a caller waiting.
+"""
+import sqlite3
+import threading
+
+import pytest
+
+import db_pool
+import db_writer
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def writer(tmp_path):
+    pool = db_pool.ConnectionPool(str(tmp_path / "writer.db"), readers=1)
+    with pool.writer() as conn:
+        conn.execute("CREATE TABLE Item (name TEXT PRIMARY KEY)")
+        conn.commit()
+    writer = db_writer.DatabaseWriter(pool, batch_window=0)
+    writer.start()
+    yield writer
+    writer.stop()
+    pool.close()
+
+
+def insert(conn, name):
+    conn.execute("INSERT INTO Item (name) VALUES (?)", (name,))
+    return name
+
+
+def count(conn):
+    return conn.execute("SELECT COUNT(*) FROM Item").fetchone()[0]
+
+
+def rollback_and_raise(conn):
+    # Ends the batch transaction under the writer, so its savepoint is gone
+    conn.execute("ROLLBACK")
+    raise ValueError("job failed")
+
+
+def rollback_and_return(conn):
+    conn.execute("ROLLBACK")
+
+
+@pytest.mark.parametrize("job", [rollback_and_raise, rollback_and_return])
+def test_job_killing_the_transaction_does_not_stop_the_writer(writer, job):
+    with pytest.raises(sqlite3.Error):
+        writer.submit(job).result(timeout=TIMEOUT)
+    assert writer.submit(insert, "after").result(timeout=TIMEOUT) == "after"
+    assert writer.submit(count).result(timeout=TIMEOUT) == 1
+    assert writer.stats()["running"]
+
+
+def test_failing_job_is_rolled_back_alone(writer):
+    futures = [writer.submit(insert, "a"), writer.submit(insert, "a"), writer.submit(insert, "b")]
+    assert futures[0].result(timeout=TIMEOUT) == "a"
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[1].result(timeout=TIMEOUT)
+    assert futures[2].result(timeout=TIMEOUT) == "b"
+    assert writer.execute(count) == 2
+
+
+# The thread is killed on purpose
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_writer_fails_queued_jobs_and_refuses_new_ones(writer, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def block(conn):
+        started.set()
+        release.wait(TIMEOUT)
+
+    first = writer.submit(block)
+    assert started.wait(TIMEOUT)
+    queued = writer.submit(insert, "queued")
+
+    def die(conn, batch):
+        raise SystemExit
+
+    monkeypatch.setattr(writer, "_commit_batch", die)
+    release.set()
+    first.result(timeout=TIMEOUT)
+    with pytest.raises(RuntimeError):
+        queued.result(timeout=TIMEOUT)
+    with pytest.raises(RuntimeError):
+        writer.submit(insert, "late")
+    assert not writer.stats()["running"]
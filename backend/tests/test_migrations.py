@@ -0,0 +1,67 @@
+"""
+Schema migrations and the query plans of the hot queries.
+
+Every query in migrations.QUERY_PLANS must be answered through an index,
+both on a database built by create_db.py and on one built with the original
+schema and then migrated.
+"""
+import os
+import runpy
+import sqlite3
+
+import pytest
+
+import migrations
+
+CREATE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "create_db.py")
+
+
+def create_db(tmp_path, monkeypatch):
+    """Run create_db.py in tmp_path; returns a connection to the database it built"""
+    monkeypatch.chdir(tmp_path)
+    runpy.run_path(CREATE_DB, run_name="create_db")
+    return sqlite3.connect(tmp_path / "data" / "reunion.db")
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    conn = create_db(tmp_path, monkeypatch)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def original_db(tmp_path, monkeypatch):
+    """The schema the app shipped with, before any migration"""
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, "migrate", lambda conn: [])
+        conn = create_db(tmp_path, monkeypatch)
+    # Columns added by migrations 4 and 5
+    conn.execute("ALTER TABLE Image DROP COLUMN storage")
+    conn.execute("ALTER TABLE Image DROP COLUMN sha256")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_fresh_database_is_fully_migrated(fresh_db):
+    assert migrations.current_version(fresh_db) == migrations.MIGRATIONS[-1][0]
+    assert migrations.migrate(fresh_db) == []
+
+
+def test_fresh_database_query_plans(fresh_db):
+    assert migrations.check_query_plans(fresh_db) == []
+
+
+def test_original_schema_query_plans_after_migrate(original_db):
+    assert migrations.check_query_plans(original_db) != []
+    assert migrations.migrate(original_db) == [name for _, name, _ in migrations.MIGRATIONS]
+    assert migrations.check_query_plans(original_db) == []
+
+
+def test_migrations_are_idempotent(fresh_db):
+    # create_db.py relies on this to migrate tables it created itself
+    for _, _, upgrade in migrations.MIGRATIONS:
+        upgrade(fresh_db)
+    fresh_db.commit()
+    assert migrations.check_query_plans(fresh_db) == []
@@ -0,0 +1,65 @@
+"""
+Bounded in-process TTL cache of authenticated users.
+
+get_current_user used to read the User row on every authenticated request.
+Entries are keyed by the token's (subject, exp) and live for USER_CACHE_TTL
+seconds, never past the token's own expiry, so a cached request costs the
+JWT signature check plus a dict lookup and no database connection at all.
+
+Code that changes a User row must call invalidate(email) after the change
+is committed. A lookup that started before the invalidation cannot put its
+(possibly stale) row back, see version(). Other workers see a change once
+their entry expires.
+"""
+import os
+import time
+
+from lru_cache import LRUCache
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
+
+
+class UserCache(LRUCache):
+    """(email, token exp) -> (expires at, user dict)"""
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, email, exp):
+        """Cached user for the token, or None if absent or expired"""
+        key = (email, exp)
+        now = time.time()
+        with self._lock:
+            entry = self._lookup(key, lambda entry: entry[0] > now)
+            if entry is None:
+                self._discard(key)  # Expired
+                return None
+            return entry[1]
+
+    def put(self, email, exp, user, version):
+        """Cache user unless an invalidation happened since version() was taken"""
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            if version != self._version:
+                return
+            self._store((email, exp), (expires_at, user))
+
+    def invalidate(self, email=None):
+        """Forget every token of one user, or all users when email is None"""
+        if email is None:
+            super().invalidate()
+            return
+        with self._lock:
+            self._version += 1
+            for key in [key for key in self._entries if key[0] == email]:
+                self._discard(key)
+
+    def _stats(self):
+        return {"maxsize": self.maxsize, "ttl_seconds": self.ttl}
+
+
+cache = UserCache()
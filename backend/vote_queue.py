@@ -0,0 +1,224 @@
+"""
+Write-behind queue for city votes.
+
+Votes are appended to the durable VoteQueue table and acknowledged right away;
+a background consumer later applies them (VoteUC upsert plus the importance
+learning step) in bulk, coalescing all pending votes of a user into one
+transaction. Reads that must see a user's own votes call flush_user first.
+
+Claiming is done with DELETE ... RETURNING inside the same write transaction
+that applies the votes, so a vote is applied exactly once even when the
+consumer and a flush (or several processes) race for the same rows.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+
+VOTE_QUEUE_POLL_INTERVAL = float(os.environ.get("VOTE_QUEUE_POLL_INTERVAL", 1.0))
+VOTE_QUEUE_COALESCE_DELAY = float(os.environ.get("VOTE_QUEUE_COALESCE_DELAY", 0.05))
+# Emails per IN (...) query, well below SQLite's bound parameter limit
+PENDING_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(conn, user_email, votes):
+    """Append (city, value) votes for a user; the caller commits"""
+    now = time.time()
+    conn.cursor().executemany(
+        "INSERT INTO VoteQueue (email, city, value, enqueued_at) VALUES (?, ?, ?, ?)",
+        [(user_email, city, value, now) for city, value in votes]
+    )
+
+
+def has_pending(conn, user_email):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM VoteQueue WHERE email = ? LIMIT 1", (user_email,))
+    return cursor.fetchone() is not None
+
+
+def pending_emails(conn, user_emails):
+    """Which of user_emails have queued votes"""
+    user_emails = list(dict.fromkeys(user_emails))
+    cursor = conn.cursor()
+    pending = []
+    for start in range(0, len(user_emails), PENDING_CHUNK_SIZE):
+        chunk = user_emails[start:start + PENDING_CHUNK_SIZE]
+        cursor.execute(
+            f"SELECT DISTINCT email FROM VoteQueue WHERE email IN ({','.join('?' for _ in chunk)})",
+            chunk
+        )
+        pending.extend(row[0] for row in cursor.fetchall())
+    return pending
+
+
+def depth(conn):
+    """Number of queued votes and age in seconds of the oldest one"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), MIN(enqueued_at) FROM VoteQueue")
+    count, oldest = cursor.fetchone()
+    return count, (time.time() - oldest if oldest is not None else 0.0)
+
+
+class VoteQueueConsumer:
+    """Applies queued votes in the background and on demand.
+
+    `apply` is called as apply(conn, email, votes) with the user's votes as
+    (city, value) pairs in arrival order; it must not commit. `on_applied`
+    is called as on_applied(conn, email) after the transaction commits and
+    `on_failed` as on_failed(email) after it was rolled back.
+
+    `execute`, if given, runs the write transactions: execute(job, email) must
+    call job(write_conn, email) inside a transaction, commit it and return the
+    job's result. Without it the consumer commits on its own connection.
+    """
+
+    def __init__(self, connect, apply, on_applied=None, on_failed=None, execute=None):
+        self.connect = connect
+        self.apply = apply
+        self.on_applied = on_applied
+        self.on_failed = on_failed
+        self.execute = execute
+        self._wakeup = threading.Event()
+        # Emails whose votes are being applied, up to and including on_applied;
+        # one user's apply never makes another user's flush wait
+        self._applying = set()
+        self._applying_changed = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self.applied_votes = 0
+        self.applied_batches = 0
+        self.flushes = 0
+        self.errors = 0
+        self.last_lag = 0.0
+
+    def notify(self):
+        """Wake the consumer after new votes were committed"""
+        self._wakeup.set()
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="vote-queue-consumer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while True:
+                self._wakeup.wait(VOTE_QUEUE_POLL_INTERVAL)
+                self._wakeup.clear()
+                if not self._stopping:
+                    # Give a burst of swipes a moment to pile up
+                    time.sleep(VOTE_QUEUE_COALESCE_DELAY)
+                try:
+                    self.drain(conn)
+                except Exception:
+                    logger.exception("Failed to drain the vote queue")
+                if self._stopping:
+                    return
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _user_lock(self, user_email):
+        """Exclusive access to one user's queued votes"""
+        with self._applying_changed:
+            while user_email in self._applying:
+                self._applying_changed.wait()
+            self._applying.add(user_email)
+        try:
+            yield
+        finally:
+            with self._applying_changed:
+                self._applying.discard(user_email)
+                self._applying_changed.notify_all()
+
+    def drain(self, conn):
+        """Apply every user's pending votes, one transaction per user"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT email FROM VoteQueue")
+        for (email,) in cursor.fetchall():
+            try:
+                with self._user_lock(email):
+                    self._apply_user(conn, email)
+            except Exception:
+                # Leave this user's votes queued and carry on with the others
+                self.errors += 1
+                logger.exception("Failed to apply queued votes for %s", email)
+
+    def flush_user(self, conn, user_email):
+        """Apply a user's pending votes now (read-your-writes for their next read).
+
+        Also waits for a background apply of the same user that is in
+        progress, so its effects (including on_applied) are visible on return.
+        """
+        # Checked in this order so an apply that already committed but has not
+        # run on_applied yet is still waited for
+        if not has_pending(conn, user_email):
+            with self._applying_changed:
+                if user_email not in self._applying:
+                    return 0
+        with self._user_lock(user_email):
+            if not has_pending(conn, user_email):
+                return 0
+            self.flushes += 1
+            return self._apply_user(conn, user_email)
+
+    def _claim_and_apply(self, conn, user_email):
+        """Delete the user's queued votes and apply them, in the caller's transaction"""
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM VoteQueue WHERE email = ? RETURNING id, city, value, enqueued_at",
+            (user_email,)
+        )
+        rows = sorted(cursor.fetchall(), key=lambda row: row[0])
+        if rows:
+            self.apply(conn, user_email, [(row[1], row[2]) for row in rows])
+        return rows
+
+    def _apply_user(self, conn, user_email):
+        try:
+            if self.execute is not None:
+                rows = self.execute(self._claim_and_apply, user_email)
+            else:
+                try:
+                    rows = self._claim_and_apply(conn, user_email)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception:
+            if self.on_failed is not None:
+                self.on_failed(user_email)
+            raise
+        if not rows:
+            return 0
+        self.applied_votes += len(rows)
+        self.applied_batches += 1
+        self.last_lag = time.time() - rows[0][3]
+        if self.on_applied is not None:
+            self.on_applied(conn, user_email)
+        return len(rows)
+
+    def stats(self, conn):
+        count, oldest_age = depth(conn)
+        return {
+            "running": self._thread is not None,
+            "depth": count,
+            "oldest_pending_seconds": oldest_age,
+            "last_apply_lag_seconds": self.last_lag,
+            "applied_votes": self.applied_votes,
+            "applied_batches": self.applied_batches,
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
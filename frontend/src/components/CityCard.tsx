@@ -37,7 +37,8 @@ const CityCard: React.FC<CityCardProps> = ({
   const hasImage = city.image_ids && city.image_ids.length > 0;
   const imageId = hasImage ? city.image_ids[0] : null;
   const backendUrl = 'http://localhost:8000';
-  const imageUrl = imageId ? `${backendUrl}/images/${imageId}` : null;
+  // Swipe cards only need the card-sized variant, not the original photo
+  const imageUrl = imageId ? `${backendUrl}/images/${imageId}?size=card` : null;
   const displayImageUrl = imageError || !imageUrl 
     ? `https://placehold.co/400x250/CBD5E0/718096?text=${encodeURIComponent(city.name)}`
     : imageUrl;
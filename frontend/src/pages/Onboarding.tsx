@@ -26,7 +26,7 @@ import { useNavigate } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
 import SwipeableCity from '../components/SwipeableCity';
 import { City, Vote, CityCategory } from '../types';
-import { getCitiesForEvaluation, voteCity } from '../services/api';
+import { getCitiesForEvaluation, voteCitiesBatch } from '../services/api';
 
 const MIN_CITIES_TO_EVALUATE = 5;
 
@@ -40,6 +40,8 @@ const Onboarding: React.FC = () => {
   const [error, setError] = useState<string | null>(null);
   const [evaluatedCount, setEvaluatedCount] = useState(0);
   const [votingComplete, setVotingComplete] = useState(false);
+  const [pendingVotes, setPendingVotes] = useState<Vote[]>([]);
+  const [submitting, setSubmitting] = useState(false);
 
   // --- Modal State --- 
   const [selectedCity, setSelectedCity] = useState<City | null>(null);
@@ -69,36 +71,49 @@ const Onboarding: React.FC = () => {
     fetchCities();
   }, [isAuthenticated, navigate]);
 
+  // Send every collected vote in one request; they are kept for a retry on failure
+  const submitVotes = async (votes: Vote[]): Promise<boolean> => {
+    if (votes.length === 0) return true;
+    try {
+      setSubmitting(true);
+      await voteCitiesBatch(votes);
+      setPendingVotes([]);
+      setError(null);
+      return true;
+    } catch (err: any) {
+      setError('Failed to register your votes. Please try again.');
+      console.error(err);
+      return false;
+    } finally {
+      setSubmitting(false);
+    }
+  };
+
   const handleSwipe = async (liked: boolean) => {
     if (currentIndex >= cities.length) return;
 
     const currentCity = cities[currentIndex];
-    
-    try {
-      // Send vote to API
-      const voteValue: Vote = {
-        city: currentCity.name,
-        value: liked ? 1 : 0
-      };
-      
-      await voteCity(voteValue);
-      
-      // Update state
-      const newEvaluatedCount = evaluatedCount + 1;
-      setEvaluatedCount(newEvaluatedCount);
-      setCurrentIndex(prev => prev + 1);
-      
-      // Check if we've finished the minimum required evaluations
-      if (newEvaluatedCount >= MIN_CITIES_TO_EVALUATE) {
-        setVotingComplete(true);
-      }
-    } catch (err: any) {
-      setError('Failed to register your vote. Please try again.');
-      console.error(err);
+    const voteValue: Vote = {
+      city: currentCity.name,
+      value: liked ? 1 : 0
+    };
+    const votes = [...pendingVotes, voteValue];
+    setPendingVotes(votes);
+
+    // Update state
+    const newEvaluatedCount = evaluatedCount + 1;
+    setEvaluatedCount(newEvaluatedCount);
+    setCurrentIndex(prev => prev + 1);
+
+    // Check if we've finished the minimum required evaluations (or run out of cities)
+    if (newEvaluatedCount >= MIN_CITIES_TO_EVALUATE || currentIndex + 1 >= cities.length) {
+      setVotingComplete(true);
+      await submitVotes(votes);
     }
   };
 
-  const handleFinish = () => {
+  const handleFinish = async () => {
+    if (!(await submitVotes(pendingVotes))) return;
     navigate('/dashboard');
   };
 
@@ -213,6 +228,7 @@ const Onboarding: React.FC = () => {
                   colorScheme="primary"
                   size="lg"
                   onClick={handleFinish}
+                  isLoading={submitting}
                 >
                   Go to Dashboard
                 </Button>
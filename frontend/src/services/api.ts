@@ -74,6 +74,11 @@ export const voteCity = async (vote: Vote): Promise<{ status: string }> => {
   return response.data;
 };
 
+export const voteCitiesBatch = async (votes: Vote[]): Promise<{ status: string; count: number }> => {
+  const response = await api.post<{ status: string; count: number }>('/cities/vote/batch', { votes });
+  return response.data;
+};
+
 export const getRecommendations = async (limit: number = 10): Promise<City[]> => {
   const response = await api.get<City[]>(`/recommendations?limit=${limit}`);
   return response.data;